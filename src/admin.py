@@ -0,0 +1,259 @@
+"""
+administration of the user database, run it from the `src` directory (preferably while the bot is stopped,
+a running bot only sees imported users after a restart), e.g:
+    python admin.py export users.csv
+    python admin.py import users.jsonl --dry-run
+    python admin.py replay --run weekly-2021-09-05 --speedup 10
+"""
+from typing import Iterable, Iterator, Optional, TextIO, Union
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+
+from bot import Bot
+from broadcast import Broadcaster
+from broadcast_queue import BroadcastQueue
+from fake_bot import FakeBot
+from user_store import UserStore, iter_users, write_users
+
+USERS_DB = '../userdata.db'
+BROADCASTS_DB = '../broadcasts.db'
+FORMATS = ('jsonl', 'csv')
+COLUMNS = ('chat_id',) + UserStore.FIELDS
+BOOLEAN_FIELDS = ('wantsUpdate', 'reminders')
+TRUE = ('1', 'true', 'yes')
+FALSE = ('0', 'false', 'no')
+
+
+def file_format(path: str, given: Optional[str]) -> str:
+    """
+    :return: `given`, or the format of the file's extension
+    """
+    if given is not None:
+        return given
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension not in FORMATS:
+        raise SystemExit(f"can't tell the format of {path}, pass --format")
+    return extension
+
+
+def to_boolean(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in TRUE:
+        return True
+    if str(value).lower() in FALSE:
+        return False
+    raise ValueError(f'expected a boolean, got {value!r}')
+
+
+def validate(record) -> tuple[str, dict]:
+    """
+    checks a user record of an import, csv values are strings so every field is converted to its type
+    :return: (chat id, the user's info)
+    :raise ValueError: if the record isn't valid
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f'expected an object, got {type(record).__name__}')
+    if None in record:  # csv.DictReader's key for the values past the header
+        raise ValueError('more values than columns in the header')
+    record = {field: value for field, value in record.items() if value not in (None, '')}
+    unknown = set(record) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(sorted(unknown))}')
+    if 'chat_id' not in record:
+        raise ValueError('missing chat_id')
+    chat_id = str(record.pop('chat_id'))
+    if not chat_id.lstrip('-').isdigit():
+        raise ValueError(f'chat_id should be a number, got {chat_id!r}')
+
+    info = {}
+    for field, value in record.items():
+        if field in BOOLEAN_FIELDS:
+            info[field] = to_boolean(value)
+        elif field == 'digestTime':
+            info[field] = datetime.datetime.strptime(str(value), '%H:%M').strftime('%H:%M')
+        elif isinstance(value, (int, str)) and not isinstance(value, bool) and str(value).lstrip('-').isdigit():
+            info[field] = int(value)
+        else:
+            raise ValueError(f'{field} should be a number, got {value!r}')
+
+    if 'grade' in info and info['grade'] not in set(Bot.GRADES.values()):
+        raise ValueError(f'grade should be one of {sorted(set(Bot.GRADES.values()))}, got {info["grade"]}')
+    if 'days' in info and (info['days'] % 7 or not Bot.MIN_WEEK <= info['days'] // 7 <= Bot.MAX_WEEK):
+        raise ValueError(f'days should be a multiple of 7 between {Bot.MIN_WEEK * 7} and {Bot.MAX_WEEK * 7}, '
+                         f'got {info["days"]}')
+    if 'digestDay' in info and not 0 <= info['digestDay'] <= 6:
+        raise ValueError(f'digestDay should be between 0 (monday) and 6 (sunday), got {info["digestDay"]}')
+    return chat_id, info
+
+
+def read_records(f: TextIO, format_: str) -> Iterator[tuple[int, Union[str, dict]]]:
+    """
+    :return: the line number and the unparsed record (a jsonl line or the fields of a csv row) of every record,
+        one record at a time. jsonl lines are parsed by `parse_record` so a malformed one only skips itself
+    """
+    if format_ == 'csv':
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(f, 1):
+        if line.strip():
+            yield line_number, line
+
+
+def parse_record(record: Union[str, dict]) -> tuple[str, dict]:
+    """
+    :return: (chat id, the user's info) of a record of `read_records`
+    :raise ValueError: if the record isn't valid
+    """
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'invalid json: {e}')
+    return validate(record)
+
+
+def valid_users(records: Iterable[tuple[int, Union[str, dict]]], source: str,
+                errors: list[str]) -> Iterator[tuple[str, dict]]:
+    for line_number, record in records:
+        try:
+            user = parse_record(record)
+        except (ValueError, TypeError) as e:
+            errors.append(f'{source}:{line_number}: {e}')
+            print(errors[-1], file=sys.stderr)
+            continue
+        yield user
+
+
+def import_users(args) -> int:
+    errors: list[str] = []
+    with open(args.path, newline='', encoding='utf-8') as f:
+        users = valid_users(read_records(f, file_format(args.path, args.format)), args.path, errors)
+        if args.dry_run:
+            count = sum(1 for _ in users)
+            print(f'{count} valid users, {len(errors)} invalid (dry run, nothing was written)')
+        else:
+            count = write_users(args.db, users, args.batch_size)
+            print(f'imported {count} users into {args.db}, skipped {len(errors)} invalid')
+    return 1 if errors else 0
+
+
+def export_users(args) -> int:
+    format_ = file_format(args.path, args.format) if args.path != '-' else args.format or 'jsonl'
+    f = sys.stdout if args.path == '-' else open(args.path, 'w', newline='', encoding='utf-8')
+    try:
+        count = 0
+        if format_ == 'csv':
+            writer = csv.DictWriter(f, COLUMNS)
+            writer.writeheader()
+        for chat_id, info in iter_users(args.db, args.batch_size):
+            if format_ == 'csv':
+                writer.writerow({'chat_id': chat_id, **info})
+            else:
+                f.write(json.dumps({'chat_id': chat_id, **info}, ensure_ascii=False) + '\n')
+            count += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    print(f'exported {count} users', file=sys.stderr)
+    return 0
+
+
+def planned_messages(db: str, batch_size: int) -> Iterator[tuple[str, dict]]:
+    """
+    :return: a message for every subscriber, what the weekly update would send (without rendering it)
+    """
+    for chat_id, info in iter_users(db, batch_size):
+        segment = UserStore.segment(info)
+        if segment is not None:
+            yield chat_id, {'text': '{}/{}'.format(*segment)}
+
+
+def replay(args) -> int:
+    """
+    sends a recorded run (or the next weekly update) through the broadcaster's rate limits to a fake bot.
+    everything that takes time is divided by `speedup` and the measured time multiplied back, so a long run can
+    be estimated quickly
+    """
+    queue = None
+    if args.run is not None:
+        queue = BroadcastQueue(args.queue)
+        if not queue.stats(args.run):
+            queue.close()
+            raise SystemExit(f'no run {args.run} in {args.queue}')
+        messages = queue.messages(args.run)
+    else:
+        messages = planned_messages(args.db, args.batch_size)
+    count = 0
+
+    def counted() -> Iterator[tuple[str, dict]]:
+        nonlocal count
+        for message in messages:
+            count += 1
+            yield message
+
+    speedup = args.speedup
+    bot = FakeBot(args.latency / speedup, args.flood_rate, args.retry_after / speedup)
+    broadcaster = Broadcaster(workers=args.workers, global_rate=args.rate * speedup,
+                              global_burst=Broadcaster.GLOBAL_BURST,
+                              per_chat_interval=Broadcaster.PER_CHAT_INTERVAL / speedup)
+    logging.getLogger('broadcast').setLevel(logging.ERROR)  # the floods are counted below, with unscaled times
+    start = time.monotonic()
+    try:
+        report = broadcaster.broadcast(bot, counted(), name='replay')
+    finally:
+        if queue is not None:
+            queue.close()
+    elapsed = (time.monotonic() - start) * speedup
+    print(f'replayed {count} messages ({args.run or "next weekly update"})\n'
+          f'estimated duration: {datetime.timedelta(seconds=round(elapsed))} '
+          f'({count / max(elapsed, 1e-9):.1f} msg/s at {args.rate:g} msg/s)\n'
+          f'flood control errors: {bot.floods}, retries: {report.retries}, failed: {len(report.failed)}')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=USERS_DB, help='the users database')
+    parser.add_argument('--batch-size', type=int, default=1000, help='users read or written at a time')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='write the users as jsonl or csv')
+    export_parser.add_argument('path', nargs='?', default='-', help='the output file, stdout by default')
+    export_parser.add_argument('--format', choices=FORMATS, help="by default the output file's extension")
+    export_parser.set_defaults(func=export_users)
+
+    import_parser = commands.add_parser('import', help='add or replace users from a jsonl or csv file')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=FORMATS, help="by default the file's extension")
+    import_parser.add_argument('--dry-run', action='store_true', help='only validate the records')
+    import_parser.set_defaults(func=import_users)
+
+    replay_parser = commands.add_parser('replay', help='estimate how long a broadcast takes, against a fake bot')
+    replay_parser.add_argument('--run', help='a run recorded in the broadcasts queue, the next weekly update '
+                                             'of the users in --db by default')
+    replay_parser.add_argument('--queue', default=BROADCASTS_DB, help='the broadcasts queue database')
+    replay_parser.add_argument('--rate', type=float, default=Broadcaster.GLOBAL_RATE, help='messages per second')
+    replay_parser.add_argument('--workers', type=int, default=Broadcaster.WORKERS)
+    replay_parser.add_argument('--latency', type=float, default=0.1, help='seconds a send_message call takes')
+    replay_parser.add_argument('--flood-rate', type=float, default=0.0,
+                               help='share of the sends refused with a flood control error')
+    replay_parser.add_argument('--retry-after', type=float, default=5, help='seconds a flood control error asks for')
+    replay_parser.add_argument('--speedup', type=float, default=1.0, help='replay this many times faster')
+    replay_parser.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.exit(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Coroutine
+import asyncio
+import logging
+import multiprocessing
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCore:
+    """
+    one asyncio event loop, running in its own thread, that owns the workbook refreshes and the scheduled
+    deliveries. blocking calls (the http fetch, telegram sends) run on an io thread pool and the cpu-bound
+    workbook parse runs in a process pool, so the telegram handlers never wait on either
+    """
+    IO_WORKERS = 4
+    PARSE_WORKERS = 1
+
+    def __init__(self, io_workers: int = IO_WORKERS, parse_workers: int = PARSE_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        self.io_pool = ThreadPoolExecutor(io_workers, thread_name_prefix='async-io')
+        # spawn, forking a process that runs threads isn't safe
+        self.cpu_pool = ProcessPoolExecutor(parse_workers, mp_context=multiprocessing.get_context('spawn'))
+        self.thread = threading.Thread(target=self.run_loop, name='async-core', daemon=True)
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.submit(self.cancel_tasks()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.io_pool.shutdown(wait=False)
+        self.cpu_pool.shutdown(wait=False)
+
+    @staticmethod
+    async def cancel_tasks():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, coroutine: Coroutine) -> Future:
+        """
+        schedules `coroutine` on the event loop from any thread
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def run_blocking(self, func: Callable, *args):
+        return await self.loop.run_in_executor(self.io_pool, func, *args)
+
+    async def run_cpu(self, func: Callable, *args):
+        """
+        runs `func` in the process pool, `func` and its arguments must be picklable
+        """
+        return await self.loop.run_in_executor(self.cpu_pool, func, *args)
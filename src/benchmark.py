@@ -0,0 +1,255 @@
+"""
+benchmarks the hot paths of the bot against synthetic exam workbooks and a fake telegram bot,
+reporting wall time, peak memory and messages/sec
+
+run it from the `src` directory, e.g:
+    python benchmark.py --rows 365 2000 --columns 3 10 --users 1000
+with --check it also verifies that every workbook reader parses the synthetic workbooks into the same events
+"""
+from dataclasses import dataclass
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+from openpyxl.utils.cell import column_index_from_string
+
+from bot import Bot
+from broadcast import Broadcaster
+from excel_handler import ExcelWorker, ParseCache, WorkbookSource, parse_workbook
+from fake_bot import FakeBot
+
+SHEET_NAME = 'תשפ"ב'
+GRADE_NAMES = {9: 'ט', 10: 'י', 11: 'יא', 12: 'יב'}
+LAYOUT = WorkbookSource('benchmark', '', '')
+FILLS = [None, 'FFFFFF00', *LAYOUT.bagrot_colors, *LAYOUT.inside_bagrot_colors]
+INTERVALS = [7 * week for week in range(Bot.MAX_WEEK)]
+SUBJECTS = ['מתמטיקה', 'אנגלית', 'היסטוריה', 'ספרות', 'תנ"ך', 'פיזיקה', 'כימיה', 'ביולוגיה', 'אזרחות & <חברה>']
+
+
+def generate_workbook(path: str, rows: int, columns_per_grade: int, density: float = 0.15,
+                      merge_ratio: float = 0.1, seed: int = 0):
+    """
+    writes a workbook in the default `WorkbookSource` layout: the class names of every grade on `grades_row`,
+    one row per day in `date_column` starting four weeks before this week's sunday, and events with the
+    exam fill colors, some of them merged across all the classes of a grade
+    """
+    rand = random.Random(seed)
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = SHEET_NAME
+
+    date_column = column_index_from_string(LAYOUT.date_column)
+    first_row = LAYOUT.grades_row + 1
+    grade_columns = {}
+    column = date_column + 1
+    for grade, name in GRADE_NAMES.items():
+        grade_columns[grade] = (column, column + columns_per_grade - 1)
+        for i in range(columns_per_grade):
+            worksheet.cell(row=LAYOUT.grades_row, column=column, value=f'{name}{i + 1}')
+            column += 1
+
+    start = ExcelWorker.get_this_week_sunday() - datetime.timedelta(weeks=4)
+    for day in range(rows):
+        row = first_row + day
+        worksheet.cell(row=row, column=date_column,
+                       value=datetime.datetime.combine(start + datetime.timedelta(days=day), datetime.time()))
+        for min_col, max_col in grade_columns.values():
+            if rand.random() < merge_ratio:
+                add_event(worksheet, rand, row, min_col)
+                worksheet.merge_cells(start_row=row, end_row=row, start_column=min_col, end_column=max_col)
+                continue
+            for col in range(min_col, max_col + 1):
+                if rand.random() < density:
+                    add_event(worksheet, rand, row, col)
+
+    workbook.save(path)
+
+
+def add_event(worksheet, rand: random.Random, row: int, column: int):
+    name = rand.choice(SUBJECTS)
+    if rand.random() < 0.1:
+        name = f'מתכ. {name}'
+    cell = worksheet.cell(row=row, column=column, value=name)
+    color = rand.choice(FILLS)
+    if color is not None:
+        cell.fill = PatternFill('solid', start_color=color, end_color=color)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *_):
+        pass
+
+
+def serve_directory(directory: str) -> ThreadingHTTPServer:
+    """
+    serves `directory` on a local port, standing in for the workbook's download url
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@dataclass
+class Result:
+    name: str
+    size: str
+    best: float
+    mean: float
+    peak: int
+    rate: Optional[str] = None
+
+    def __str__(self):
+        return f'{self.name:<28}{self.size:<24}{self.best * 1000:>11.3f}{self.mean * 1000:>11.3f}' \
+               f'{self.peak / 1024:>13.1f}  {self.rate or ""}'
+
+
+HEADER = f'{"benchmark":<28}{"size":<24}{"best (ms)":>11}{"mean (ms)":>11}{"peak (KiB)":>13}  rate'
+
+
+def measure(name: str, size: str, func: Callable, repeat: int, setup: Callable = lambda: None) -> Result:
+    """
+    times `repeat` runs of `func`, then measures its peak memory in one more run under tracemalloc
+    """
+    times = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return Result(name, size, min(times), statistics.mean(times), peak)
+
+
+READERS = ('openpyxl', 'xlsx')
+
+
+def check_readers(url: str, path: str, readers: tuple[str, ...] = READERS) -> int:
+    """
+    parses the workbook at `path` (served on `url`) with every reader
+    :return: the number of events, if all the readers agree
+    :raise AssertionError: if a reader's events or dates differ from the first reader's
+    """
+    worker = ExcelWorker(WorkbookSource('benchmark', url, path, reader=readers[0]), INTERVALS)
+    expected = parse_workbook(path, worker.GRADES, worker.source)
+    for reader in readers[1:]:
+        parsed = parse_workbook(path, worker.GRADES, WorkbookSource('benchmark', '', path, reader=reader))
+        for grade, events in expected[0].items():
+            assert parsed[0][grade] == events, f'{reader} read different events for grade {grade} than {readers[0]}'
+        assert parsed[1] == expected[1], f'{reader} read different dates than {readers[0]}'
+    return sum(len(day) for rows in expected[0].values() for day in rows.values())
+
+
+def bench_workbook(directory: str, url: str, rows: int, columns: int, repeat: int,
+                   reader: str = READERS[0]) -> list[Result]:
+    size = f'{rows} rows x {columns * len(GRADE_NAMES)} cols'
+    path = os.path.join(directory, 'schedule.xlsx')
+    generate_workbook(path, rows, columns)
+    worker = ExcelWorker(WorkbookSource('benchmark', url, path, reader=reader), INTERVALS)
+    results = []
+
+    def force_reparse():
+        worker.content_hash = ''
+        worker.etag = worker.last_modified = None
+        worker.parse_cache = ParseCache()
+
+    worker.open_worksheet()
+    results.append(measure(f'open_worksheet [{reader}]', size, worker.open_worksheet, repeat))
+    results.append(measure('set_grades_columns', size, worker.set_grades_columns, repeat))
+    results.append(measure(f'parse_sheet [{reader}]', size, worker.parse_sheet, repeat))
+    results.append(measure('update_schedule (changed)', size, lambda: worker.update_schedule(INTERVALS),
+                           repeat, setup=force_reparse))
+    results.append(measure('update_schedule (304)', size, lambda: worker.update_schedule(INTERVALS),
+                           repeat))
+    if worker.workbook is not None:
+        worker.workbook.close()
+    return results
+
+
+def bench_bot(directory: str, url: str, rows: int, columns: int, users: int, rate: float, latency: float,
+              repeat: int) -> list[Result]:
+    size = f'{users} users'
+    path = os.path.join(directory, 'bot.xlsx')
+    generate_workbook(path, rows, columns)
+    rand = random.Random(0)
+    users_path = os.path.join(directory, f'users-{users}.json')
+    with open(users_path, 'w') as f:
+        json.dump({str(chat_id): {'grade': rand.choice(list(GRADE_NAMES)),
+                                  'days': 7 * rand.randint(Bot.MIN_WEEK, Bot.MAX_WEEK),
+                                  'wantsUpdate': rand.random() < 0.9}
+                   for chat_id in range(users)}, f)
+
+    # the scheduler only starts with `bot.run`, so nothing is sent to telegram
+    bot = Bot('123456:benchmark', users_path, path, True, download_url=url)
+    with bot.excel_handler._refresh_lock:  # let a background refresh (after a cache hit) finish before timing
+        pass
+    bot.broadcaster = Broadcaster(global_rate=rate, global_burst=rate, per_chat_interval=0)
+    schedule = bot.excel_handler.get_schedule(bot.update_interval)
+    results = [measure('format_schedule', f'{Bot.MAX_WEEK} weeks x {len(schedule)} grades',
+                       lambda: [bot.format_schedule(weeks[:Bot.MAX_WEEK]) for weeks in schedule.values()], repeat)]
+
+    fake = FakeBot(latency)
+    result = measure('update_all', size, lambda: bot.update_all(fake), repeat, setup=fake.sent.clear)
+    if len(fake.sent) > 1:
+        elapsed = fake.sent[-1][1] - min(sent_at for _, sent_at in fake.sent)
+        result.rate = f'{len(fake.sent)} msgs, {len(fake.sent) / max(elapsed, 1e-9):.0f} msg/s'
+    results.append(result)
+    bot.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[365], help='days in the synthetic workbooks')
+    parser.add_argument('--columns', type=int, nargs='+', default=[3], help='classes per grade')
+    parser.add_argument('--users', type=int, nargs='+', default=[1000], help='subscribers for update_all')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='broadcast rate limit in msg/s, 0 for unlimited (telegram allows about 30)')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every fake send_message takes')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--readers', nargs='+', choices=READERS, default=list(READERS),
+                        help='workbook readers to benchmark')
+    parser.add_argument('--check', action='store_true', help='check that the readers parse the same events')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = serve_directory(directory)
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        print(HEADER)
+        for rows in args.rows:
+            for columns in args.columns:
+                for reader in args.readers:
+                    for result in bench_workbook(directory, f'{base_url}/schedule.xlsx', rows, columns, args.repeat,
+                                                 reader):
+                        print(result)
+                if args.check:
+                    events = check_readers(f'{base_url}/schedule.xlsx', os.path.join(directory, 'schedule.xlsx'),
+                                           tuple(args.readers))
+                    print(f'{"readers agree":<28}{events} events, {", ".join(args.readers)}')
+        for users in args.users:
+            for result in bench_bot(directory, f'{base_url}/bot.xlsx', args.rows[0], args.columns[0], users,
+                                    args.rate or 1e9, args.latency, args.repeat):
+                print(result)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,43 @@
-from telegram import ParseMode, ForceReply, ReplyKeyboardMarkup, Update
+from telegram import (
+    ParseMode,
+    ForceReply,
+    ReplyKeyboardMarkup,
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from telegram.ext import (
     Updater,
     PicklePersistence,
     CommandHandler,
     CallbackQueryHandler,
     CallbackContext,
+    InlineQueryHandler,
     ConversationHandler,
     Filters,
     MessageHandler,
 )
 import telegram
-from apscheduler.schedulers.background import BackgroundScheduler
-from excel_handler import ExcelWorker
+from async_core import AsyncCore
+from broadcast import Broadcaster
+from broadcast_queue import BroadcastQueue, run_broadcast
+from delivery_scheduler import DIGEST, Delivery, DeliveryScheduler
+from excel_handler import ExcelWorker, WorkbookSource
 from event import Event
-from typing import Union
+from event_index import EventIndex
+from schedule_diff import ScheduleDiff, diff_events
+from sources import SourceRegistry
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS, start_metrics_server
+from typing import Optional, Union
+from user_store import UserStore, open_user_store
+import datetime
+import functools
 import logging
-import json
-import time
-from creds import EXCEL_URL
+import os
+import threading
+from creds import DOWNLOAD_URL, EXCEL_URL
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.INFO)
@@ -28,19 +48,37 @@ START, GRADE, WEEK = range(3)
 
 
 def catch_errors(func):
+    @functools.wraps(func)
     def wrapper(self, *args):
         try:
             return func(self, *args)
-        except Exception as e:
-            pass
+        except Exception:
+            logger.exception('Error in %s', func.__name__)
+            HANDLER_ERRORS.inc(handler=func.__name__)
+    return wrapper
+
+
+def timed(callback):
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        with HANDLER_SECONDS.time(handler=callback.__name__):
+            try:
+                return callback(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=callback.__name__)
+                raise
+    wrapper.timed = True
     return wrapper
 
 
 class Bot(Updater):
     WEEKS_FORMAT = {0: 'שבוע הזה', 1: 'שבוע הבא',
-                    2: 'עוד שבועיים', 3: 'עוד שלושה שבועות '}
+                    2: 'עוד שבועיים', 3: 'עוד שלושה שבועות ', 4: 'עוד ארבעה שבועות'}
     MAX_WEEK = 4
     MIN_WEEK = 1
+    # a digest delivered on these days (friday and saturday) is past the school week, so it starts at next week.
+    # its horizon is counted from there, which is why the schedule holds one week beyond `MAX_WEEK`
+    NEXT_WEEK_DIGEST_DAYS = (4, 5)
     GRADES = {'ט': 9, 'י': 10, 'יא': 11, 'יב': 12,
               "ט'": 9, "י'": 10, "יא'": 11, "יב'": 12}
     GRADES_KEYBOARD = [["ט'"], ["י'"], ["יא'"], ["יב'"]]
@@ -49,28 +87,53 @@ class Bot(Updater):
     OPTIONS = ReplyKeyboardMarkup(keyboard=[['עדכן'], ['שנה כיתה', 'שנה אופק התראה'],
                                             ['עצור עדכון אוטומטי', 'שחזר עדכון אוטומטי'], ['▶️התחל', '❓עזרה']])
     RETURN_OPTION = [['🔙חזור']]
+    INLINE_CACHE_TIME = 60  # seconds telegram may cache an inline answer
+    DAYS = ['ראשון', 'שני', 'שלישי', 'רביעי', 'חמישי', 'שישי', 'שבת']
+    SOURCE = 'yth'
+    SHEET_NAME = 'תשפ"ב'
     DETAILS = "\n\n💡 לחיצה על התאריך תשלח אתכם ליומן גוגל\n" \
               rf"ללוח מבחנים המלא: <a href='{EXCEL_URL}'>לחץ כאן</a>"
 
     # noinspection PyTypeChecker
     def __init__(self, bot_token: str, user_info_filepath: str, excel_path: str, use_context=False,
-                 update_interval: Union[list, None] = None):
+                 update_interval: Union[list, None] = None, download_url: str = DOWNLOAD_URL,
+                 metrics_port: Optional[int] = None, broadcast_workers: int = 0):
+        """
+        :param broadcast_workers: when set, the weekly update is sent from this many processes sharing a durable
+            queue (`broadcasts.db`, next to the users) instead of from this process
+        """
 
         assert len(
-            self.WEEKS_FORMAT) == self.MAX_WEEK, "WEEKS_FORMAT should match the number of WEEKS"
+            self.WEEKS_FORMAT) == self.MAX_WEEK + 1, "WEEKS_FORMAT should match the number of WEEKS"
 
         if not (isinstance(update_interval, list) or update_interval is None):
             raise TypeError(
                 f'update_interval expected: list or None, got: {type(update_interval).__name__}')
         if update_interval is None:
-            self.update_interval = [7 * i for i in range(self.MAX_WEEK)]
+            self.update_interval = [7 * i for i in range(self.MAX_WEEK + 1)]
         else:
             self.update_interval = update_interval
 
         super().__init__(bot_token, use_context=use_context)
-        self.save_users_filepath = user_info_filepath
-        self.users = self.get_user_info(user_info_filepath)
-        self.excel_handler = ExcelWorker(excel_path, self.update_interval)
+        self.metrics_port = metrics_port
+        self.users: UserStore = open_user_store(user_info_filepath)
+        self.core = AsyncCore()
+        self.core.start()
+        self.sources = SourceRegistry(self.update_interval, core=self.core)
+        self.excel_handler = self.sources.add(WorkbookSource(self.SOURCE, download_url, excel_path,
+                                                             sheet_name=self.SHEET_NAME, reader='xlsx'))
+        self.broadcaster = Broadcaster()
+        self.broadcast_workers = broadcast_workers
+        self.broadcast_queue_path = os.path.join(os.path.dirname(user_info_filepath), 'broadcasts.db')
+        self.rendered: dict[tuple[int, int, int], str] = {}  # (grade, first week, weeks) -> message
+        self.rendered_for: tuple[int, datetime.date] = (0, datetime.date.min)  # (schedule version, date)
+        self.rendered_lock = threading.Lock()
+        self.excel_handler.change_listeners.append(self.notify_changes)
+        self.scheduler = DeliveryScheduler(os.path.join(os.path.dirname(user_info_filepath), 'deliveries.db'),
+                                           self.core, self.users, self.deliver, self.next_exam_date)
+        self.users.listeners.append(self.scheduler.plan)
+        # exams may have moved, so the reminders are planned again
+        self.excel_handler.change_listeners.append(lambda old_index, new_index: self.scheduler.plan_all())
 
         # init command handlers
         start = [CommandHandler('start', self.start), MessageHandler(
@@ -89,6 +152,13 @@ class Bot(Updater):
                    MessageHandler(Filters.regex('^שחזר עדכון אוטומטי$'), self.start_updating_me)]
         cancel = [CommandHandler('cancel', self.cancel), MessageHandler(
             Filters.regex('^🔙חזור$'), self.cancel)]
+        next_exam = CommandHandler('next', self.next_exam)
+        date = CommandHandler('date', self.events_on_date)
+        digest = CommandHandler('digest', self.change_digest)
+        reminders = CommandHandler('reminders', self.toggle_reminders)
+        pages = [CommandHandler('weeks', self.send_pages),
+                 CallbackQueryHandler(self.turn_page, pattern=r'^week:\d+:\d+$')]
+        inline = InlineQueryHandler(self.inline_schedule)
 
         setup_handler = ConversationHandler(
             entry_points=start,
@@ -127,38 +197,56 @@ class Bot(Updater):
         self.add_handler(stop)
         self.add_handler(restart)
         self.add_handler(update)
+        self.add_handler(next_exam)
+        self.add_handler(date)
+        self.add_handler(digest)
+        self.add_handler(reminders)
+        self.add_handler(pages)
+        self.add_handler(inline)
 
         self.add_handler(MessageHandler(
             Filters.text, self.unknown_message(self.OPTIONS)))
 
-        # update_all scheduler
-        scheduler = BackgroundScheduler()
-        scheduler.add_job(lambda: self.update_all(
-            self.bot), trigger='cron', day_of_week='sun', hour='7', minute='00')
-        scheduler.start()
-
     def add_handler(self, handler):
         if isinstance(handler, (list, tuple)):
             for item in handler:
-                self.dispatcher.add_handler(item)
+                self.add_handler(item)
         else:
+            self.instrument(handler)
             self.dispatcher.add_handler(handler)
 
+    def instrument(self, handler):
+        """
+        times the callback of `handler`, or of every handler nested in a `ConversationHandler`
+        """
+        if isinstance(handler, ConversationHandler):
+            for item in handler.entry_points + handler.fallbacks + \
+                    [item for state in handler.states.values() for item in state]:
+                self.instrument(item)
+        elif not getattr(handler.callback, 'timed', False):
+            handler.callback = timed(handler.callback)
+
     def add_task(self, task_func, interval):
         self.job_queue.run_repeating(task_func, interval=interval)
 
     def run(self):
+        if self.metrics_port is not None:
+            start_metrics_server(self.metrics_port)
+        if self.broadcast_workers:
+            self.core.submit(self.core.run_blocking(self.resume_broadcasts))
+        # the digests and reminders, every user on their own day and time
+        self.core.submit(self.scheduler.run())
         self.start_polling()
         self.idle()
+        self.close()
 
-    @staticmethod
-    def get_user_info(filepath) -> dict[str, dict]:
-        with open(filepath) as f:
-            return json.load(f)
-
-    def save_user_info(self):
-        with open(self.save_users_filepath, 'w') as f:
-            json.dump(self.users, f, indent=4)
+    def close(self):
+        """
+        stops the async core and closes the databases, the bot can't be used afterwards
+        """
+        self.core.stop()
+        self.scheduler.close()
+        self.users.close()
 
     def start(self, update: Update, context: CallbackContext):
         # check if it's not the first login
@@ -181,19 +269,17 @@ class Bot(Updater):
         if str(update.effective_user.id) not in self.users:
             update.message.reply_text('עליך קודם להירשם!\nלחץ ▶️התחל')
         else:
-            self.users[str(update.effective_user.id)]['wantsUpdate'] = False
+            self.users.update(str(update.effective_user.id), wantsUpdate=False)
             update.message.reply_text(
                 "😔 לא תקבל עוד עדכונים...\nאם תתחרט לחץ 'שחזר עדכון אוטומטי'")
-            self.save_user_info()
 
     def start_updating_me(self, update: Update, _: CallbackContext):
         if str(update.effective_user.id) not in self.users:
             update.message.reply_text('עליך קודם להירשם!\nלחץ ▶️התחל')
         else:
-            self.users[str(update.effective_user.id)]['wantsUpdate'] = True
+            self.users.update(str(update.effective_user.id), wantsUpdate=True)
             update.message.reply_text(
                 "משבוע הבא תקבל עדכונים אוטומטים!\nכדי להפסיק לחץ 'עצור עדכון אוטומטי'")
-            self.save_user_info()
 
     def grade(self, update: Update, context: CallbackContext):
         result = self.grade_callback(update, context)
@@ -211,10 +297,12 @@ class Bot(Updater):
         if update.message.text == 'לא ארצה עדכון אוטומטי':
             context.user_data['days'] = 7
             context.user_data['wantsUpdate'] = False
-            self.users[user] = context.user_data
+            if user in self.users:
+                self.users.update(user, days=7, wantsUpdate=False)
+            else:
+                self.users[user] = context.user_data
             update.message.reply_text("לא תקבל עדכונים שבועיים אך תמיד תוכל לבקש ידנית: /update או 'עדכן'",
                                       reply_markup=self.OPTIONS)
-            self.save_user_info()
         else:
 
             try:
@@ -229,14 +317,13 @@ class Bot(Updater):
                 context.user_data['days'] = weeks * 7
 
                 if user in self.users:
-                    self.users[user]['wantsUpdate'] = context.user_data['wantsUpdate']
-                    self.users[user]['days'] = context.user_data['days']
+                    self.users.update(user, wantsUpdate=context.user_data['wantsUpdate'],
+                                      days=context.user_data['days'])
                 else:
                     self.users[user] = context.user_data
 
                 update.message.reply_text(f'החל משבוע הבא, תקבל עדכון ל{weeks} שבוע/ות הבא/ים',
                                           reply_markup=self.OPTIONS)
-                self.save_user_info()
 
             except (IndexError, ValueError):
                 if self.users[user]["wantsUpdate"]:
@@ -285,10 +372,10 @@ class Bot(Updater):
         return ConversationHandler.END
 
     def unknown_message(self, keyboard):
-        def wrapper(update: Update, _: CallbackContext):
+        def unknown(update: Update, _: CallbackContext):
             update.message.reply_text(f"לא הבנתי\nבבקשה תשתמש בכפתורים\n",
                                       parse_mode=ParseMode.MARKDOWN_V2, reply_markup=keyboard)
-        return wrapper
+        return unknown
 
     def grade_callback(self, update: Update, context: CallbackContext):
         grade = update.message.text
@@ -305,27 +392,146 @@ class Bot(Updater):
             if user in self.users:
                 update.message.reply_text(
                     'הכיתה שונתה בהצלחה!', reply_markup=self.OPTIONS)
-                self.users[user]['grade'] = context.user_data['grade']
-                self.save_user_info()
+                self.users.update(user, grade=context.user_data['grade'])
         return ConversationHandler.END
 
     @catch_errors
     def update_all(self, bot: telegram.Bot) -> None:
-        schedule: dict[int, list[list[Event]]
-                       ] = self.excel_handler.get_schedule(self.update_interval)
-        for user in self.users:
-            if 'days' not in self.users[user] or not self.users[user]['wantsUpdate']:
+        """
+        sends every subscriber their weekly update at once, the scheduled digests go through `deliver`
+        """
+        segments = self.users.segments()
+        logger.info('Weekly update segments: %s',
+                    {f'{grade}/{weeks}': len(chat_ids) for (grade, weeks), chat_ids in segments.items()})
+        self.send_segments(bot, f'weekly-{datetime.date.today()}', 'weekly', {
+            f'{grade}/{weeks}': (self.message_kwargs(self.render_message(grade, weeks)), chat_ids)
+            for (grade, weeks), chat_ids in segments.items()})
+
+    def message_kwargs(self, text: str) -> dict:
+        return dict(text=text, parse_mode=ParseMode.HTML, disable_web_page_preview=True, reply_markup=self.OPTIONS)
+
+    def send_segments(self, bot: telegram.Bot, run_id: str, name: str, segments: dict[str, tuple[dict, list[str]]]):
+        """
+        sends every segment's message to its chats, from the worker processes through the durable queue if
+        `broadcast_workers` is set (where a chat gets at most one message per `run_id`), else from this process
+        :param segments: segment -> (keyword arguments for `bot.send_message`, chat ids)
+        """
+        if not self.broadcast_workers:
+            self.broadcast_segments(bot, run_id, name, segments)
+            return
+        queue = BroadcastQueue(self.broadcast_queue_path)
+        try:
+            queue.enqueue(run_id, name, segments)
+        finally:
+            queue.close()
+        logger.info('%s: %s', run_id, run_broadcast(self.broadcast_queue_path, bot.token, run_id,
+                                                   self.broadcast_workers))
+
+    def broadcast_segments(self, bot: telegram.Bot, run_id: str, name: str,
+                           segments: dict[str, tuple[dict, list[str]]]):
+        """
+        sends every segment's message to its chats from this process, see `send_segments`
+        """
+        messages = ((chat_id, message) for message, chat_ids in segments.values() for chat_id in chat_ids)
+        logger.info('%s: %s', run_id, self.broadcaster.broadcast(bot, messages, name=name))
+
+    def deliver(self, kind: str, occurrence: str, deliveries: list[Delivery]):
+        """
+        sends a batch of scheduled deliveries, see `DeliveryScheduler`. a slot's deliveries come in a batch per
+        tick of its stagger, each a few chats, so they are sent from this process even with `broadcast_workers`
+        (the scheduler records what was delivered, the durable queue would only add a process start per tick)
+        """
+        segments: dict[str, tuple[dict, list[str]]] = {}
+        for delivery in deliveries:
+            info = self.users.get(delivery.chat_id)
+            if info is None or 'grade' not in info:
                 continue
+            if kind == DIGEST:
+                segment = self.users.segment(info)
+                if segment is None:
+                    continue
+                grade, weeks = segment
+                first_week = int(self.scheduler.settings(info)[0] in self.NEXT_WEEK_DIGEST_DAYS)
+                key = f'{grade}/{weeks}/{first_week}'
+                if key not in segments:
+                    segments[key] = (self.message_kwargs(self.render_message(grade, weeks + first_week, first_week)),
+                                     [])
+            else:
+                key = str(info['grade'])
+                if key not in segments:
+                    text = self.render_reminder(info['grade'], datetime.date.fromisoformat(occurrence))
+                    if text is None:  # the exam was moved since the reminder was planned
+                        continue
+                    segments[key] = (self.message_kwargs(text), [])
+            segments[key][1].append(delivery.chat_id)
+        self.broadcast_segments(self.bot, f'{kind}-{occurrence}', kind, segments)
+
+    def render_reminder(self, grade: int, date: datetime.date) -> Optional[str]:
+        """
+        :return: the reminder of the exams of `grade` on `date`, None if there are none
+        """
+        exams = [event for event in self.excel_handler.get_event_index(self.update_interval).on(grade, date)
+                 if event.type_ in EventIndex.EXAM_TYPES]
+        if not exams:
+            return None
+        msg = '<u><b>⏰ תזכורת: מחר</b></u>\n'
+        for event in exams:
+            msg += f'{event: <10|%d/%m/%y}\n'
+        return msg + self.DETAILS
+
+    def next_exam_date(self, grade: int, since: datetime.date) -> Optional[datetime.date]:
+        event = self.excel_handler.get_event_index(self.update_interval).next_event(grade, since,
+                                                                                     EventIndex.EXAM_TYPES)
+        return None if event is None else event.date
 
-            message = self.format_schedule(schedule[self.users[user]['grade']][: self.users[user]['days'] // 7]) \
-                + self.DETAILS
-            try:
-                bot.send_message(chat_id=user, text=message, parse_mode=ParseMode.HTML,
-                                 disable_web_page_preview=True, reply_markup=self.OPTIONS)
-            except Exception:
-                print(f'Failed to update {user}')
-                continue
-            time.sleep(1)
+    @catch_errors
+    def resume_broadcasts(self):
+        """
+        finishes the queued broadcasts that were interrupted, e.g. by a restart
+        """
+        queue = BroadcastQueue(self.broadcast_queue_path)
+        try:
+            runs = queue.unfinished_runs()
+        finally:
+            queue.close()
+        for run_id, name in runs:
+            logger.info('Resuming broadcast %s', run_id)
+            stats = run_broadcast(self.broadcast_queue_path, self.bot.token, run_id, self.broadcast_workers)
+            logger.info('Broadcast %s: %s', run_id, stats)
+
+    def notify_changes(self, old_index: EventIndex, new_index: EventIndex):
+        """
+        sends the subscribers whose horizon was touched by a workbook update only the changes
+        """
+        today = datetime.date.today()
+        sunday = ExcelWorker.get_this_week_sunday()
+        segments = self.users.segments()
+        diffs = {grade: diff_events(old_index.events.get(grade, []), new_index.events.get(grade, []))
+                 for grade in {grade for grade, _ in segments}}
+
+        def messages():
+            for (grade, weeks), chat_ids in segments.items():
+                diff = diffs[grade].within(today, sunday + datetime.timedelta(days=weeks * 7 - 1))
+                if not diff:
+                    continue
+                message = dict(text=self.format_changes(diff), parse_mode=ParseMode.HTML,
+                               disable_web_page_preview=True, reply_markup=self.OPTIONS)
+                for chat_id in chat_ids:
+                    yield chat_id, message
+
+        report = self.broadcaster.broadcast(self.bot, messages(), name='changes')
+        logger.info('Schedule changes: %s', report)
+
+    @staticmethod
+    def format_changes(diff: ScheduleDiff) -> str:
+        msg = '<u><b>עדכון בלוח המבחנים</b></u>\n'
+        for event in diff.added:
+            msg += f'➕ {event: <10|%d/%m/%y}\n'
+        for old, new in diff.moved:
+            msg += f'🔄 {new: <10|%d/%m/%y} (במקום {old.date:%d/%m/%y})\n'
+        for event in diff.removed:
+            msg += f'❌ <s>{event: <10|%d/%m/%y}</s>\n'
+        return msg
 
     @catch_errors
     def update_one(self, update: Update, context: CallbackContext):
@@ -335,17 +541,179 @@ class Bot(Updater):
             return
 
         try:
-            schedule: dict[int, list[list[Event]]] = self.excel_handler.get_schedule(
-                self.update_interval)
+            message = self.render_message(self.users[user]['grade'], self.users[user]['days'] // 7)
         except RuntimeError as e:
             update.message.reply_text(text=str(e))
         else:
-            message = self.format_schedule(schedule[self.users[user]['grade']][: self.users[user]['days'] // 7]) \
-                + self.DETAILS
-
             context.bot.send_message(chat_id=user, text=message, parse_mode=ParseMode.HTML,
                                      disable_web_page_preview=True, reply_markup=self.OPTIONS)
 
+    @catch_errors
+    def next_exam(self, update: Update, _: CallbackContext):
+        user = str(update.effective_user.id)
+        if user not in self.users or 'grade' not in self.users[user]:
+            update.message.reply_text('עליך קודם להירשם\nלחץ /start')
+            return
+
+        event_index = self.excel_handler.get_event_index(self.update_interval)
+        event = event_index.next_event(self.users[user]['grade'], datetime.date.today(), EventIndex.EXAM_TYPES)
+        if event is None:
+            update.message.reply_text('<b>אין מבחנים קרובים</b>😁', parse_mode=ParseMode.HTML,
+                                      reply_markup=self.OPTIONS)
+            return
+        update.message.reply_text(f'<u><b>המבחן הבא</b></u>\n{event: <10|%d/%m/%y}' + self.DETAILS,
+                                  parse_mode=ParseMode.HTML, disable_web_page_preview=True,
+                                  reply_markup=self.OPTIONS)
+
+    @catch_errors
+    def events_on_date(self, update: Update, context: CallbackContext):
+        user = str(update.effective_user.id)
+        if user not in self.users or 'grade' not in self.users[user]:
+            update.message.reply_text('עליך קודם להירשם\nלחץ /start')
+            return
+
+        date = self.parse_date(context.args[0]) if context.args else None
+        if date is None:
+            update.message.reply_text('הזן תאריך בפורמט: /date 31/12/21', reply_markup=self.OPTIONS)
+            return
+
+        events = self.excel_handler.get_event_index(self.update_interval).on(self.users[user]['grade'], date)
+        message = f'<u><b>{date:%d/%m/%y}</b></u>\n'
+        if len(events) == 0:
+            message += "<b>אין אירועים</b>😁"
+        for event in events:
+            message += f'{event: <10|%d/%m/%y}\n'
+        update.message.reply_text(message + self.DETAILS, parse_mode=ParseMode.HTML,
+                                  disable_web_page_preview=True, reply_markup=self.OPTIONS)
+
+    @catch_errors
+    def send_pages(self, update: Update, _: CallbackContext):
+        """
+        sends this week's schedule with buttons that page through the next weeks in the same message
+        """
+        user = str(update.effective_user.id)
+        if user not in self.users or 'grade' not in self.users[user]:
+            update.message.reply_text('עליך קודם להירשם\nלחץ /start')
+            return
+        grade = self.users[user]['grade']
+        update.message.reply_text(self.render_page(grade, 0), parse_mode=ParseMode.HTML,
+                                  disable_web_page_preview=True, reply_markup=self.page_keyboard(grade, 0))
+
+    @catch_errors
+    def turn_page(self, update: Update, _: CallbackContext):
+        query = update.callback_query
+        _, grade, week = query.data.split(':')
+        grade, week = int(grade), min(int(week), self.MAX_WEEK - 1)
+        try:
+            query.edit_message_text(self.render_page(grade, week), parse_mode=ParseMode.HTML,
+                                    disable_web_page_preview=True, reply_markup=self.page_keyboard(grade, week))
+        except telegram.error.BadRequest as e:  # e.g. the same page was pressed twice
+            if 'not modified' not in str(e):
+                raise
+        finally:
+            query.answer()
+
+    @catch_errors
+    def inline_schedule(self, update: Update, _: CallbackContext):
+        """
+        answers `@bot grade 11` (or `@bot יא`) with a page for every week, the grade defaults to the user's
+        """
+        query = update.inline_query
+        grade = self.parse_grade(query.query)
+        personal = grade is None
+        if grade is None:
+            grade = self.users.get(str(query.from_user.id), {}).get('grade')
+        if grade is None:
+            query.answer([], cache_time=self.INLINE_CACHE_TIME, is_personal=True,
+                         switch_pm_text='הירשמו כדי לראות את לוח המבחנים', switch_pm_parameter='inline')
+            return
+
+        name = next(text for text, number in self.GRADES.items() if number == grade)
+        results = [InlineQueryResultArticle(
+            id=f'{grade}:{week}', title=f'כיתה {name} - {self.WEEKS_FORMAT[week]}',
+            input_message_content=InputTextMessageContent(self.render_page(grade, week), parse_mode=ParseMode.HTML,
+                                                          disable_web_page_preview=True),
+            reply_markup=self.page_keyboard(grade, week)) for week in range(self.MAX_WEEK)]
+        query.answer(results, cache_time=self.INLINE_CACHE_TIME, is_personal=personal)
+
+    @classmethod
+    def parse_grade(cls, text: str) -> Optional[int]:
+        """
+        :return: the grade in an inline query, by number (9-12) or by name, None if there isn't one
+        """
+        for word in text.replace('כיתה', ' ').replace('grade', ' ').split():
+            if word in cls.GRADES:
+                return cls.GRADES[word]
+            if word.isdigit() and int(word) in cls.GRADES.values():
+                return int(word)
+        return None
+
+    @catch_errors
+    def change_digest(self, update: Update, context: CallbackContext):
+        user = str(update.effective_user.id)
+        if user not in self.users or 'grade' not in self.users[user]:
+            update.message.reply_text('עליך קודם להירשם\nלחץ /start')
+            return
+
+        day = self.parse_day(context.args[0]) if len(context.args) == 2 else None
+        at = self.parse_time(context.args[1]) if day is not None else None
+        if at is None:
+            day, at = self.scheduler.settings(self.users[user])
+            update.message.reply_text(f'העדכון השבועי נשלח בכל יום {self.DAYS[(day + 1) % 7]} בשעה {at:%H:%M}\n'
+                                      'כדי לשנות: /digest ראשון 07:00', reply_markup=self.OPTIONS)
+            return
+        self.users.update(user, digestDay=day, digestTime=f'{at:%H:%M}')
+        update.message.reply_text(f'מעכשיו העדכון השבועי יישלח בכל יום {self.DAYS[(day + 1) % 7]} בשעה {at:%H:%M}',
+                                  reply_markup=self.OPTIONS)
+
+    @catch_errors
+    def toggle_reminders(self, update: Update, _: CallbackContext):
+        user = str(update.effective_user.id)
+        if user not in self.users or 'grade' not in self.users[user]:
+            update.message.reply_text('עליך קודם להירשם\nלחץ /start')
+            return
+
+        reminders = not self.users[user].get('reminders', False)
+        self.users.update(user, reminders=reminders)
+        if reminders:
+            update.message.reply_text('⏰ תקבל תזכורת יום לפני כל מבחן\nכדי להפסיק: /reminders',
+                                      reply_markup=self.OPTIONS)
+        else:
+            update.message.reply_text('לא תקבל עוד תזכורות לפני מבחנים\nכדי לחדש: /reminders',
+                                      reply_markup=self.OPTIONS)
+
+    @classmethod
+    def parse_day(cls, text: str) -> Optional[int]:
+        """
+        :return: the weekday (0 = monday) of a day's name or number (1 = sunday), None if it isn't one
+        """
+        text = text.strip("'")
+        if text in cls.DAYS:
+            return (cls.DAYS.index(text) - 1) % 7
+        if text.isdigit() and 1 <= int(text) <= 7:
+            return (int(text) - 2) % 7
+        return None
+
+    @staticmethod
+    def parse_time(text: str) -> Optional[datetime.time]:
+        try:
+            return datetime.datetime.strptime(text, '%H:%M').time()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def parse_date(text: str) -> Optional[datetime.date]:
+        for date_format in ('%d/%m/%y', '%d/%m/%Y'):
+            try:
+                return datetime.datetime.strptime(text, date_format).date()
+            except ValueError:
+                pass
+        try:  # no year, use the current one
+            date = datetime.datetime.strptime(text, '%d/%m')
+        except ValueError:
+            return None
+        return date.replace(year=datetime.date.today().year).date()
+
     def help(self, update: Update, _: CallbackContext):
         help_message = ''
         for idx, command in enumerate(_.bot.get_my_commands()):
@@ -354,9 +722,43 @@ class Bot(Updater):
         update.message.reply_text(help_message, reply_markup=self.OPTIONS,
                                   parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
-    def format_schedule(self, schedule: list[list[Event]]):
+    def render_message(self, grade: int, weeks: int, first_week: int = 0) -> str:
+        """
+        renders the schedule of `grade` from week `first_week` up to week `weeks` (this week is 0), every
+        message is rendered once per schedule version and day (past events are struck through)
+        """
+        version, schedule = self.excel_handler.get_schedule_snapshot(self.update_interval)
+        today = datetime.date.today()
+        key = (grade, first_week, weeks)
+        with self.rendered_lock:
+            if self.rendered_for != (version, today):
+                self.rendered.clear()
+                self.rendered_for = (version, today)
+            if key not in self.rendered:
+                self.rendered[key] = self.format_schedule(schedule[grade][first_week:weeks], first_week) + \
+                                     self.DETAILS
+            return self.rendered[key]
+
+    def render_page(self, grade: int, week: int) -> str:
+        """
+        :return: the schedule of `grade` for a single week
+        """
+        return self.render_message(grade, week + 1, first_week=week)
+
+    def page_keyboard(self, grade: int, week: int) -> InlineKeyboardMarkup:
+        """
+        :return: buttons that page the message to the previous / next week, see `turn_page`
+        """
+        buttons = []
+        if week > 0:
+            buttons.append(InlineKeyboardButton('◀️ הקודם', callback_data=f'week:{grade}:{week - 1}'))
+        if week < self.MAX_WEEK - 1:
+            buttons.append(InlineKeyboardButton('הבא ▶️', callback_data=f'week:{grade}:{week + 1}'))
+        return InlineKeyboardMarkup([buttons])
+
+    def format_schedule(self, schedule: list[list[Event]], first_week: int = 0):
         msg = ''
-        for i, week in enumerate(schedule):
+        for i, week in enumerate(schedule, first_week):
             msg += f'<u><b>{self.WEEKS_FORMAT[i]}</b></u>\n'
 
             # only notice the weeks where there are event
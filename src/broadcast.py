@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+import logging
+import threading
+import time
+
+import telegram
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from metrics import BROADCAST_MESSAGES, QUEUE_DEPTH, SEND_SECONDS, log_event
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    a thread-safe token bucket, `acquire` blocks until a token is available
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        stops handing out tokens for `seconds`, used when telegram asks us to back off
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+@dataclass
+class BroadcastReport:
+    sent: int = 0
+    retries: int = 0
+    failed: list[str] = field(default_factory=list)
+    elapsed: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return f'sent {self.sent} messages in {self.elapsed:.2f}s ({self.throughput:.1f} msg/s), ' \
+               f'{self.retries} retries, {len(self.failed)} failed'
+
+
+class Broadcaster:
+    """
+    sends messages to many chats concurrently while keeping to telegram's rate limits:
+    about 30 messages per second overall and one message per second per chat
+    """
+    GLOBAL_RATE = 30  # messages per second
+    GLOBAL_BURST = 30
+    PER_CHAT_INTERVAL = 1.0  # seconds between two messages to the same chat
+    MAX_RETRIES = 3
+    BACKOFF = 0.5  # seconds, doubled on every retry
+    WORKERS = 8
+
+    def __init__(self, workers: int = WORKERS, global_rate: float = GLOBAL_RATE,
+                 global_burst: float = GLOBAL_BURST, per_chat_interval: float = PER_CHAT_INTERVAL,
+                 bucket: Optional[TokenBucket] = None):
+        """
+        :param bucket: the global rate limiter, anything with `acquire` and `pause` (e.g. one shared between
+            processes), by default a `TokenBucket` of `global_rate` and `global_burst`
+        """
+        self.workers = workers
+        self.bucket = bucket or TokenBucket(global_rate, global_burst)
+        self.per_chat_interval = per_chat_interval
+        self.last_sent: dict[str, float] = {}
+        self.last_sent_lock = threading.Lock()
+
+    def wait_for_chat(self, chat_id: str):
+        with self.last_sent_lock:
+            now = time.monotonic()
+            send_at = max(now, self.last_sent.get(chat_id, 0.0) + self.per_chat_interval)
+            self.last_sent[chat_id] = send_at
+        if send_at > now:
+            time.sleep(send_at - now)
+
+    def send(self, bot: telegram.Bot, chat_id: str, kwargs: dict, report: BroadcastReport) -> bool:
+        """
+        :return: whether the message was delivered
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.wait_for_chat(chat_id)
+            self.bucket.acquire()
+            try:
+                with SEND_SECONDS.time():
+                    bot.send_message(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                logger.warning('Flood control on %s, pausing for %ss', chat_id, e.retry_after)
+                self.bucket.pause(e.retry_after)
+            except BadRequest as e:  # permanent, e.g. chat not found
+                logger.warning('Failed to update %s: %s', chat_id, e)
+                break
+            except (TimedOut, NetworkError) as e:
+                logger.info('Transient error updating %s: %s', chat_id, e)
+                time.sleep(self.BACKOFF * 2 ** attempt)
+            except Exception as e:
+                logger.warning('Failed to update %s: %s', chat_id, e)
+                break
+            else:
+                BROADCAST_MESSAGES.inc(result='sent')
+                with report.lock:
+                    report.sent += 1
+                return True
+
+            if attempt < self.MAX_RETRIES:
+                BROADCAST_MESSAGES.inc(result='retried')
+                with report.lock:
+                    report.retries += 1
+
+        BROADCAST_MESSAGES.inc(result='failed')
+        with report.lock:
+            report.failed.append(chat_id)
+        return False
+
+    def send_queued(self, bot: telegram.Bot, chat_id: str, kwargs: dict, report: BroadcastReport):
+        try:
+            self.send(bot, chat_id, kwargs, report)
+        finally:
+            QUEUE_DEPTH.dec()
+
+    def broadcast(self, bot: telegram.Bot, messages: Iterable[tuple[str, dict]],
+                  name: str = 'broadcast') -> BroadcastReport:
+        """
+        :param bot: the bot to send the messages through
+        :param messages: pairs of (chat_id, keyword arguments for `bot.send_message`), read as they are sent
+        :param name: the name of the run in the structured log
+        :return: a report of the run
+        """
+        report = BroadcastReport()
+        start = time.monotonic()
+        # bounds the messages waiting for a thread, so a streamed `messages` isn't read far ahead of the sends
+        ahead = threading.BoundedSemaphore(self.workers * 2)
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='broadcast') as executor:
+            for chat_id, kwargs in messages:
+                ahead.acquire()
+                QUEUE_DEPTH.inc()
+                executor.submit(self.send_queued, bot, chat_id, kwargs, report).add_done_callback(
+                    lambda _: ahead.release())
+        report.elapsed = time.monotonic() - start
+        log_event('broadcast', name=name, sent=report.sent, retries=report.retries, failed=len(report.failed),
+                  seconds=round(report.elapsed, 4), throughput=round(report.throughput, 2))
+        return report
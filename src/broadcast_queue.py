@@ -0,0 +1,284 @@
+"""
+a durable, sqlite backed queue that lets several processes share a broadcast run.
+the producer enqueues one job per (run, chat id) pointing at its segment's pre-rendered message, and the
+worker processes claim the jobs one at a time and send them through a rate limiter shared between them
+"""
+from multiprocessing import get_context
+from typing import Iterator, Optional
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import telegram
+from telegram import ReplyMarkup
+
+from broadcast import Broadcaster, BroadcastReport
+from metrics import BROADCAST_MESSAGES, QUEUE_DEPTH, log_event
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+UNKNOWN = 'unknown'  # the worker died while sending, the message may or may not have been delivered
+
+STATS_INTERVAL = 1.0  # seconds between exports of the run's progress to the metrics while the workers send
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+def encode_message(kwargs: dict) -> str:
+    """
+    :return: the keyword arguments of `send_message` as json, reply markups are sent to telegram as json anyway
+    """
+    return json.dumps({name: value.to_json() if isinstance(value, ReplyMarkup) else value
+                       for name, value in kwargs.items()}, ensure_ascii=False)
+
+
+class BroadcastQueue:
+    """
+    every chat id appears once per run, so enqueuing a run again (e.g. after a restart) never duplicates a
+    message, and a job leaves `pending` only once, so no two workers send it
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY, name TEXT, created REAL, finished REAL);
+            CREATE TABLE IF NOT EXISTS segments (
+                run_id TEXT, segment TEXT, message TEXT, PRIMARY KEY (run_id, segment));
+            CREATE TABLE IF NOT EXISTS jobs (
+                run_id TEXT, chat_id TEXT, segment TEXT, status TEXT, worker TEXT, updated REAL,
+                PRIMARY KEY (run_id, chat_id));
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (run_id, status);
+        """)
+
+    def transaction(self):
+        """
+        takes the write lock up front, so two processes can't both read a job as pending
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def enqueue(self, run_id: str, name: str, segments: dict[str, tuple[dict, list[str]]]) -> int:
+        """
+        :param run_id: identifies the run, enqueuing the same run again only adds the chats it didn't have
+        :param name: the name of the run in the structured log
+        :param segments: segment -> (keyword arguments for `bot.send_message`, chat ids)
+        :return: the number of jobs added
+        """
+        now = time.time()
+        connection = self.transaction()
+        try:
+            connection.execute('INSERT OR IGNORE INTO runs (run_id, name, created) VALUES (?, ?, ?)',
+                               (run_id, name, now))
+            added = 0
+            for segment, (message, chat_ids) in segments.items():
+                message = encode_message(message)
+                # keyed by the message too: a later enqueue of the run (e.g. the digests of another day of the
+                # week) may render the segment differently, and its chats should get what it rendered
+                segment = f'{segment}:{hashlib.sha256(message.encode()).hexdigest()[:16]}'
+                connection.execute('INSERT OR IGNORE INTO segments (run_id, segment, message) VALUES (?, ?, ?)',
+                                   (run_id, segment, message))
+                added += connection.executemany(
+                    'INSERT OR IGNORE INTO jobs (run_id, chat_id, segment, status, updated) VALUES (?, ?, ?, ?, ?)',
+                    ((run_id, str(chat_id), segment, PENDING, now) for chat_id in chat_ids)).rowcount
+            connection.execute('UPDATE runs SET finished = NULL WHERE run_id = ?', (run_id,))
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return added
+
+    def claim(self, run_id: str, worker: str) -> Optional[tuple[str, dict]]:
+        """
+        moves one pending job to `sending`
+        :return: (chat id, keyword arguments for `bot.send_message`), or None if the run has no pending jobs
+        """
+        connection = self.transaction()
+        try:
+            row = connection.execute('SELECT jobs.chat_id, segments.message FROM jobs '
+                                     'JOIN segments USING (run_id, segment) '
+                                     'WHERE jobs.run_id = ? AND jobs.status = ? LIMIT 1', (run_id, PENDING)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE jobs SET status = ?, worker = ?, updated = ? WHERE run_id = ? AND chat_id = ?',
+                                   (SENDING, worker, time.time(), run_id, row[0]))
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        if row is None:
+            return None
+        chat_id, message = row
+        return chat_id, json.loads(message)
+
+    def complete(self, run_id: str, chat_id: str, delivered: bool):
+        self.connection.execute('UPDATE jobs SET status = ?, updated = ? WHERE run_id = ? AND chat_id = ?',
+                                (SENT if delivered else FAILED, time.time(), run_id, chat_id))
+
+    def recover(self, run_id: str) -> int:
+        """
+        marks the jobs that were being sent when their worker died as `unknown`. they are not sent again: telegram
+        can't tell us whether they were delivered, and a missed weekly update is better than a duplicate one
+        :return: the number of jobs recovered
+        """
+        return self.connection.execute('UPDATE jobs SET status = ?, updated = ? WHERE run_id = ? AND status = ?',
+                                       (UNKNOWN, time.time(), run_id, SENDING)).rowcount
+
+    def finish(self, run_id: str):
+        self.connection.execute('UPDATE runs SET finished = ? WHERE run_id = ?', (time.time(), run_id))
+
+    def stats(self, run_id: str) -> dict[str, int]:
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY status',
+                                            (run_id,)).fetchall())
+
+    def messages(self, run_id: str) -> Iterator[tuple[str, dict]]:
+        """
+        :return: every (chat id, keyword arguments for `bot.send_message`) of the run, whatever their status
+        """
+        cursor = self.connection.execute('SELECT jobs.chat_id, segments.message FROM jobs '
+                                         'JOIN segments USING (run_id, segment) WHERE jobs.run_id = ?', (run_id,))
+        while rows := cursor.fetchmany(1000):
+            for chat_id, message in rows:
+                yield chat_id, json.loads(message)
+
+    def unfinished_runs(self) -> list[tuple[str, str]]:
+        """
+        :return: the (run id, name) of the runs that were interrupted, oldest first
+        """
+        return self.connection.execute('SELECT run_id, name FROM runs WHERE finished IS NULL '
+                                       'ORDER BY created').fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+class SharedTokenBucket:
+    """
+    a token bucket kept in the queue's database, shared by every process that sends through it.
+    has the same interface as `broadcast.TokenBucket`, but uses wall clock time since that's common to processes
+    """
+
+    def __init__(self, path: str, rate: float, capacity: float, name: str = 'telegram'):
+        self.rate = rate
+        self.capacity = capacity
+        self.name = name
+        self.connection = connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS rate_limits ('
+                                'name TEXT PRIMARY KEY, tokens REAL, updated REAL, paused_until REAL)')
+        self.connection.execute('INSERT OR IGNORE INTO rate_limits (name, tokens, updated, paused_until) '
+                                'VALUES (?, ?, ?, 0)', (name, capacity, time.time()))
+
+    def acquire(self):
+        while True:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                tokens, updated, paused_until = self.connection.execute(
+                    'SELECT tokens, updated, paused_until FROM rate_limits WHERE name = ?', (self.name,)).fetchone()
+                now = time.time()
+                if now >= paused_until:
+                    tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+                    if tokens >= 1:
+                        tokens -= 1
+                        wait = 0.0
+                    else:
+                        wait = (1 - tokens) / self.rate
+                    self.connection.execute('UPDATE rate_limits SET tokens = ?, updated = ? WHERE name = ?',
+                                            (tokens, now, self.name))
+                else:
+                    wait = paused_until - now
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        stops handing out tokens to every process for `seconds`
+        """
+        paused_until = time.time() + seconds
+        self.connection.execute('UPDATE rate_limits SET tokens = 0, updated = MAX(updated, ?), '
+                                'paused_until = MAX(paused_until, ?) WHERE name = ?',
+                                (paused_until, paused_until, self.name))
+
+
+def work(path: str, token: str, run_id: str, worker: str, rate: float, bot: Optional[telegram.Bot] = None):
+    """
+    the body of a worker process: sends the pending jobs of `run_id` until there are none left
+    """
+    queue = BroadcastQueue(path)
+    bot = bot or telegram.Bot(token)
+    # a single thread per process, the parallelism comes from the processes
+    broadcaster = Broadcaster(workers=1, bucket=SharedTokenBucket(path, rate, rate))
+    report = BroadcastReport()
+    while (job := queue.claim(run_id, worker)) is not None:
+        chat_id, kwargs = job
+        queue.complete(run_id, chat_id, broadcaster.send(bot, chat_id, kwargs, report))
+    queue.close()
+
+
+def export_stats(stats: dict[str, int], exported: dict[str, int]) -> dict[str, int]:
+    """
+    counts the jobs that finished since `exported` in this process's metrics, the workers count their sends in
+    their own processes' registries, which nothing scrapes
+    :return: `stats`, to pass as `exported` next time
+    """
+    for status in (SENT, FAILED, UNKNOWN):
+        if (finished := stats.get(status, 0) - exported.get(status, 0)) > 0:
+            BROADCAST_MESSAGES.inc(finished, result=status)
+    QUEUE_DEPTH.set(stats.get(PENDING, 0) + stats.get(SENDING, 0))
+    return stats
+
+
+def run_broadcast(path: str, token: str, run_id: str, processes: int,
+                  rate: float = Broadcaster.GLOBAL_RATE) -> dict[str, int]:
+    """
+    sends the pending jobs of `run_id` from `processes` worker processes and waits for them to finish.
+    can be called again for an interrupted run, only the jobs that weren't claimed yet are sent
+    :return: the number of jobs in every status
+    """
+    queue = BroadcastQueue(path)
+    name = dict(queue.unfinished_runs()).get(run_id, run_id)
+    recovered = queue.recover(run_id)
+    if recovered:
+        logger.warning('%s jobs of %s were interrupted while sending and will not be retried', recovered, run_id)
+    # the jobs that finished before this call were counted by the call that ran them, except the ones recovered
+    # above, whose process died
+    exported = queue.stats(run_id)
+    exported[UNKNOWN] = exported.get(UNKNOWN, 0) - recovered
+
+    start = time.monotonic()
+    context = get_context('spawn')
+    workers = [context.Process(target=work, args=(path, token, run_id, f'{os.getpid()}-{i}', rate),
+                               name=f'broadcast-{i}', daemon=True) for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        while worker.is_alive():
+            worker.join(STATS_INTERVAL)
+            exported = export_stats(queue.stats(run_id), exported)
+
+    queue.recover(run_id)  # a worker that crashed leaves its job in `sending`
+    stats = export_stats(queue.stats(run_id), exported)
+    if not stats.get(PENDING):
+        queue.finish(run_id)
+    queue.close()
+    elapsed = time.monotonic() - start
+    log_event('broadcast', name=name, run_id=run_id, processes=processes, sent=stats.get(SENT, 0),
+              failed=stats.get(FAILED, 0), unknown=stats.get(UNKNOWN, 0), pending=stats.get(PENDING, 0),
+              seconds=round(elapsed, 4))
+    return stats
@@ -0,0 +1,217 @@
+"""
+schedules the per user deliveries: the digest on the user's day and time, and a reminder the day before each exam.
+one priority queue holds the next delivery of every user, so there is a single timer on the async core
+rather than a job per user, and what was delivered is kept in sqlite so a restart neither repeats nor skips one
+"""
+from dataclasses import dataclass
+from typing import Callable, Optional
+import asyncio
+import datetime
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+import pytz
+
+from async_core import AsyncCore
+from user_store import UserStore
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = pytz.timezone('Asia/Jerusalem')
+DIGEST = 'digest'
+REMINDER = 'reminder'
+
+
+@dataclass(frozen=True, order=True)
+class Delivery:
+    kind: str  # DIGEST or REMINDER
+    chat_id: str
+    # what is delivered, a digest once a week: the iso date of the week's sunday,
+    # a reminder once per exam day: the iso date of the exam
+    occurrence: str
+
+
+class DeliveryScheduler:
+    DEFAULT_DAY = 6  # sunday
+    DEFAULT_TIME = datetime.time(7, 0)
+    STAGGER = 15 * 60  # seconds, the deliveries of one time slot are spread over this window
+    TICK = 30  # seconds, the deliveries that are due within a tick are sent together
+    GRACE = 6 * 60 * 60  # seconds, a delivery missed by less than this (e.g. while restarting) is still sent
+    RETRY = 5 * 60  # seconds, a batch that failed to be delivered is tried again after this (within `GRACE`)
+
+    def __init__(self, path: str, core: AsyncCore, users: UserStore,
+                 deliver: Callable[[str, str, list[Delivery]], None],
+                 next_exam: Callable[[int, datetime.date], Optional[datetime.date]],
+                 timezone: datetime.tzinfo = TIMEZONE):
+        """
+        :param path: the sqlite database of the deliveries that were made
+        :param deliver: sends a batch of deliveries of the same kind and occurrence, called off the event loop
+        :param next_exam: the date of the first exam of a grade on or after a date, None if there is none
+        """
+        self.core = core
+        self.users = users
+        self.deliver = deliver
+        self.next_exam = next_exam
+        self.timezone = timezone
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS deliveries ('
+                                'kind TEXT, chat_id TEXT, occurrence TEXT, sent REAL, '
+                                'PRIMARY KEY (kind, chat_id, occurrence))')
+        self.heap: list[tuple[float, Delivery]] = []
+        self.planned: dict[tuple[str, str], tuple[float, Delivery]] = {}  # (kind, chat id) -> the next delivery
+        self.lock = threading.Lock()  # guards the heap
+        self.db_lock = threading.Lock()  # plan runs on the handler threads too
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def settings(self, info: dict) -> tuple[int, datetime.time]:
+        """
+        :return: the weekday and local time the user gets their deliveries at
+        """
+        day = info.get('digestDay', self.DEFAULT_DAY)
+        digest_time = info.get('digestTime')
+        if digest_time is None:
+            return day, self.DEFAULT_TIME
+        return day, datetime.datetime.strptime(digest_time, '%H:%M').time()
+
+    def localize(self, day: datetime.date, at: datetime.time) -> datetime.datetime:
+        return self.timezone.localize(datetime.datetime.combine(day, at))
+
+    def stagger(self, chat_id: str) -> float:
+        """
+        :return: a fixed offset for every chat, so the deliveries of a slot are spread out rather than sent at once
+        """
+        return zlib.crc32(chat_id.encode()) % self.STAGGER
+
+    def delivered(self, delivery: Delivery) -> bool:
+        with self.db_lock:
+            return self.connection.execute('SELECT 1 FROM deliveries WHERE kind = ? AND chat_id = ? AND occurrence = ?',
+                                           (delivery.kind, delivery.chat_id, delivery.occurrence)).fetchone() \
+                is not None
+
+    def next_digest(self, chat_id: str, info: dict, now: datetime.datetime) -> Optional[tuple[float, Delivery]]:
+        if self.users.segment(info) is None:
+            return None
+        day, at = self.settings(info)
+        today = now.astimezone(self.timezone).date()
+        slot_day = today - datetime.timedelta(days=(today.weekday() - day) % 7)
+        for _ in range(2):  # this week's slot, unless it was delivered or missed by too long, else next week's
+            slot = self.localize(slot_day, at)
+            sunday = slot_day - datetime.timedelta(days=(slot_day.weekday() + 1) % 7)
+            delivery = Delivery(DIGEST, chat_id, sunday.isoformat())
+            if (now - slot).total_seconds() <= self.GRACE and not self.delivered(delivery):
+                return slot.timestamp() + self.stagger(chat_id), delivery
+            slot_day += datetime.timedelta(weeks=1)
+        return None
+
+    def next_reminder(self, chat_id: str, info: dict, now: datetime.datetime) -> Optional[tuple[float, Delivery]]:
+        if not info.get('reminders') or 'grade' not in info:
+            return None
+        _, at = self.settings(info)
+        since = now.astimezone(self.timezone).date()
+        while (exam := self.next_exam(info['grade'], since)) is not None:
+            slot = self.localize(exam - datetime.timedelta(days=1), at)
+            delivery = Delivery(REMINDER, chat_id, exam.isoformat())
+            if (now - slot).total_seconds() <= self.GRACE and not self.delivered(delivery):
+                return slot.timestamp() + self.stagger(chat_id), delivery
+            since = exam + datetime.timedelta(days=1)
+        return None
+
+    def plan(self, chat_id: str, now: Optional[datetime.datetime] = None, not_before: Optional[float] = None):
+        """
+        (re)computes the next deliveries of a user, call it whenever the user's info changes
+        :param not_before: a timestamp the deliveries are postponed to if they are due earlier
+        """
+        now = now or datetime.datetime.now(self.timezone)
+        info = self.users.get(chat_id, {})
+        for kind, next_delivery in ((DIGEST, self.next_digest), (REMINDER, self.next_reminder)):
+            planned = next_delivery(chat_id, info, now)
+            with self.lock:
+                if planned is None:
+                    self.planned.pop((kind, chat_id), None)
+                    continue
+                if not_before is not None and planned[0] < not_before:
+                    planned = (not_before, planned[1])
+                if self.planned.get((kind, chat_id)) == planned:
+                    continue
+                # the entry it replaces stays in the heap and is skipped when it comes up
+                self.planned[(kind, chat_id)] = planned
+                heapq.heappush(self.heap, planned)
+        self.wake()
+
+    def plan_all(self):
+        now = datetime.datetime.now(self.timezone)
+        for chat_id in self.users:
+            self.plan(chat_id, now)
+        logger.info('Planned %s deliveries', len(self.planned))
+
+    def wake(self):
+        if self.wakeup is not None:
+            self.core.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def pop_due(self, until: float) -> list[Delivery]:
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= until:
+                entry = heapq.heappop(self.heap)
+                delivery = entry[1]
+                if self.planned.get((delivery.kind, delivery.chat_id)) == entry:
+                    del self.planned[(delivery.kind, delivery.chat_id)]
+                    due.append(delivery)
+        return due
+
+    def next_due(self) -> Optional[float]:
+        with self.lock:
+            while self.heap and self.planned.get((self.heap[0][1].kind, self.heap[0][1].chat_id)) != self.heap[0]:
+                heapq.heappop(self.heap)  # replaced
+            return self.heap[0][0] if self.heap else None
+
+    def send(self, deliveries: list[Delivery]):
+        """
+        delivers and records the batches of `deliveries`. a batch that failed isn't recorded, so it is planned
+        again: after `RETRY`, and while it's within `GRACE` of its time, also after a restart
+        """
+        batches: dict[tuple[str, str], list[Delivery]] = {}
+        for delivery in deliveries:
+            batches.setdefault((delivery.kind, delivery.occurrence), []).append(delivery)
+        failed: set[str] = set()
+        for (kind, occurrence), batch in batches.items():
+            try:
+                self.deliver(kind, occurrence, batch)
+            except Exception:
+                logger.exception('Failed to deliver %s %s to %s chats, retrying in %ss',
+                                 kind, occurrence, len(batch), self.RETRY)
+                failed.update(delivery.chat_id for delivery in batch)
+                continue
+            with self.db_lock:
+                self.connection.executemany('INSERT OR IGNORE INTO deliveries (kind, chat_id, occurrence, sent) '
+                                            'VALUES (?, ?, ?, ?)',
+                                            ((kind, delivery.chat_id, occurrence, time.time()) for delivery in batch))
+        retry_at = time.time() + self.RETRY
+        for chat_id in {delivery.chat_id for delivery in deliveries}:
+            self.plan(chat_id, not_before=retry_at if chat_id in failed else None)
+
+    async def run(self):
+        """
+        sleeps until the earliest delivery is due, then sends every delivery due within the next tick
+        """
+        self.wakeup = asyncio.Event()
+        await self.core.run_blocking(self.plan_all)
+        while True:
+            self.wakeup.clear()
+            due = self.next_due()
+            wait = None if due is None else due - time.time()
+            if wait is None or wait > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.core.run_blocking(self.send, self.pop_due(time.time() + self.TICK))
+
+    def close(self):
+        self.connection.close()
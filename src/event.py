@@ -1,4 +1,6 @@
 from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
 import datetime
 from string import Template
 import urllib.parse
@@ -10,28 +12,57 @@ TEMPLATE = Template(r"https://www.google.com/calendar/render?action=TEMPLATE&tex
 
 WEEKDAYS = {0: "יום ב", 1: "יום ג", 2: "יום ד", 3: "יום ה", 4: "יום ו",5: "שבת  ", 6: "יום א"}
 
+
+class EventType(Enum):
+    OTHER = ""
+    TEST = "מבחן"
+    BAGROT = "בגרות"
+    INSIDE_BAGROT = "בגרות פנימית"
+    MOCK_BAGROT = "מתכונת"
+
+    def __str__(self):
+        return self.value
+
+
+@lru_cache(maxsize=2048)
+def google_event_url(name: str, type_: 'EventType', date: datetime.date) -> str:
+    """
+    the google calendar url of an event, cached since only the few weeks that are rendered need it
+    """
+    title = urllib.parse.quote((f'{type_} ב' if type_ is not EventType.OTHER else "") + name)
+    end_date = date + datetime.timedelta(days=1)
+    return TEMPLATE.substitute(title=title, date=f'{date:%Y%m%d}/{end_date:%Y%m%d}')
+
+
 @dataclass(frozen=True)
 class Event:
+    # the html-escaped name is computed once (and is the name itself unless it has to be escaped).
+    # the ~350 character calendar url isn't kept per event, a year of events would mostly carry urls nobody renders
+    __slots__ = ('name', 'type_', 'date', 'escaped_name')
     name: str
-    type_: str
+    type_: EventType
     date: datetime.date
 
     """
     uses: <name_format>|<date_format>
     """
 
+    def __post_init__(self):
+        object.__setattr__(self, 'escaped_name', self.name.replace('&', '&amp;').replace(
+            '<', '&lt;').replace('>', '&gt;'))
+
+    def __reduce__(self):
+        return Event, (self.name, self.type_, self.date)
+
+    @property
+    def url(self) -> str:
+        return google_event_url(self.name, self.type_, self.date)
+
     def google_event_gen(self):
-        title = urllib.parse.quote(
-            (f'{self.type_} ב' if self.type_ != "" else "") + self.name)
-        date = self.date.strftime('%Y%m%d')
-        end_date = (self.date + datetime.timedelta(days=1)).strftime('%Y%m%d')
-        url = TEMPLATE.substitute(title=title, date=f'{date}/{end_date}')
-        return url
+        return self.url
 
     def __format__(self, format_spec: str):
         name_format_spec, date_format_spec = format_spec.split('|')
         past = datetime.date.today() > self.date
-        name = self.name.replace('&', '&amp;').replace(
-            '<', '&lt;').replace('>', '&gt;')
-        frmt = (past * "<s>") + fr'<a href="{self.google_event_gen()}">{WEEKDAYS[self.date.weekday()]} ({format(self.date, date_format_spec)})</a> -<u>{self.type_}</u> {format(name, name_format_spec)}' + (past * "</s>")
+        frmt = (past * "<s>") + fr'<a href="{self.url}">{WEEKDAYS[self.date.weekday()]} ({format(self.date, date_format_spec)})</a> -<u>{self.type_}</u> {format(self.escaped_name, name_format_spec)}' + (past * "</s>")
         return frmt
@@ -0,0 +1,41 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Optional
+import datetime
+from event import Event, EventType
+
+
+class EventIndex:
+    """
+    the events of every grade sorted by date, answers date range queries in O(log n + k)
+    """
+    EXAM_TYPES = frozenset({EventType.TEST, EventType.BAGROT, EventType.INSIDE_BAGROT, EventType.MOCK_BAGROT})
+
+    def __init__(self, events: dict[int, list[Event]]):
+        """
+        :param events: the events of every grade, events of the same date keep their order
+        """
+        self.events = {grade: sorted(grade_events, key=lambda event: event.date)
+                       for grade, grade_events in events.items()}
+        self.dates = {grade: [event.date for event in grade_events]
+                      for grade, grade_events in self.events.items()}
+
+    def between(self, grade: int, start: datetime.date, end: datetime.date) -> list[Event]:
+        """
+        :return: the events of `grade` between `start` and `end` (inclusive)
+        """
+        dates = self.dates.get(grade, [])
+        return self.events.get(grade, [])[bisect_left(dates, start):bisect_right(dates, end)]
+
+    def on(self, grade: int, date: datetime.date) -> list[Event]:
+        return self.between(grade, date, date)
+
+    def next_event(self, grade: int, since: datetime.date,
+                   types: Optional[Iterable[EventType]] = None) -> Optional[Event]:
+        """
+        :return: the first event of `grade` on or after `since` whose type is one of `types` (any type if None)
+        """
+        dates = self.dates.get(grade, [])
+        for event in self.events.get(grade, [])[bisect_left(dates, since):]:
+            if types is None or event.type_ in types:
+                return event
+        return None
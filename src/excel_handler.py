@@ -1,36 +1,210 @@
-from openpyxl import load_workbook
-import openpyxl.cell
-from openpyxl.utils.cell import column_index_from_string
+from cachetools import LRUCache
+from dataclasses import dataclass
+from typing import Callable, Optional
 import datetime
-from event import Event
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from async_core import AsyncCore
+from event import Event, EventType
+from event_index import EventIndex
+from metrics import DOWNLOAD_SECONDS, PARSE_SECONDS, SCHEDULE_LOOKUPS, log_event
+from schedule_cache import ScheduleCache
+from xlsx_reader import XlsxWorkbook, column_index
 import requests
-from creds import DOWNLOAD_URL
 import re
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """
+    a schedule is fresh for `ttl` and never past the start of the next week,
+    after that it is served stale for up to `stale_while_revalidate` while it is refreshed in the background
+    """
+    ttl: datetime.timedelta = datetime.timedelta(hours=1)
+    stale_while_revalidate: datetime.timedelta = datetime.timedelta(days=1)
+
+    def expires_at(self, now: datetime.datetime) -> datetime.datetime:
+        next_sunday = now.date() + datetime.timedelta(days=7 - (now.weekday() + 1) % 7)
+        return min(now + self.ttl, datetime.datetime.combine(next_sunday, datetime.time()))
+
+
+@dataclass(frozen=True)
+class Download:
+    """
+    a downloaded workbook, kept in a temporary file until it is parsed and installed
+    """
+    path: str
+    content_hash: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+@dataclass(frozen=True)
+class WorkbookSource:
+    """
+    a school's exam workbook: where it is downloaded from, where it is kept and how its sheet is laid out
+    """
+    name: str
+    download_url: str
+    workbook_path: str
+    sheet_name: Optional[str] = None  # the active sheet if None
+    grades_row: int = 2
+    date_column: str = 'E'
+    bagrot_colors: tuple[str, ...] = ('FF0000FF',)
+    inside_bagrot_colors: tuple[str, ...] = ('FF3D85C6', 'FF6D9EEB')
+    test_colors: tuple[str, ...] = ('00000000',)
+    reader: str = 'openpyxl'  # or 'xlsx', see `open_workbook`
+
+    def layout_key(self) -> str:
+        """
+        identifies the layout of the sheet, a parsed workbook is only valid for the layout it was parsed with
+        """
+        layout = (self.sheet_name, self.grades_row, self.date_column,
+                  self.bagrot_colors, self.inside_bagrot_colors, self.test_colors)
+        return hashlib.sha256(repr(layout).encode()).hexdigest()[:16]
+
+    def fill_types(self) -> dict[str, EventType]:
+        """
+        :return: the event type of every exam fill color, a color listed under several types gets the first of
+            bagrot, inside bagrot and test
+        """
+        types = dict.fromkeys(self.test_colors, EventType.TEST)
+        types.update(dict.fromkeys(self.inside_bagrot_colors, EventType.INSIDE_BAGROT))
+        types.update(dict.fromkeys(self.bagrot_colors, EventType.BAGROT))
+        return types
+
+    def open_workbook(self, path: str):
+        """
+        opens the workbook for reading with `self.reader`: 'openpyxl' (read only mode) or 'xlsx', the lighter
+        reader of `xlsx_reader`. both give the same events
+        """
+        if self.reader == 'xlsx':
+            return XlsxWorkbook(path)
+        if self.reader == 'openpyxl':
+            from openpyxl import load_workbook  # slow to import, so only when it's used
+            return load_workbook(path, read_only=True)
+        raise ValueError(f'{self.name}: unknown workbook reader {self.reader!r}')
+
+    def worksheet(self, workbook):
+        if self.sheet_name is None:
+            return workbook.active
+        if self.sheet_name not in workbook.sheetnames:
+            logger.warning('%s: no sheet named %s, using the active sheet', self.name, self.sheet_name)
+            return workbook.active
+        return workbook[self.sheet_name]
+
+
+class ParseCache:
+    """
+    parsed workbooks shared by all the sources, a bounded LRU per source keyed by content hash and layout
+    """
+    MAX_PER_SOURCE = 2
+
+    def __init__(self, max_per_source: int = MAX_PER_SOURCE):
+        self.max_per_source = max_per_source
+        self.caches: dict[str, LRUCache] = {}
+        self.lock = threading.Lock()
+
+    def get(self, source: str, key: str) -> Optional[tuple]:
+        with self.lock:
+            cache = self.caches.get(source)
+            return None if cache is None else cache.get(key)
+
+    def put(self, source: str, key: str, parsed: tuple):
+        with self.lock:
+            self.caches.setdefault(source, LRUCache(self.max_per_source))[key] = parsed
+
 
 class ExcelWorker:
     VALID_GRADE_COLUMNS = re.compile(r"([טיאב']+)\d")
-    GRADES_ROW = 2
-    GRADES = {9: (None, None), 10: (None, None),
-              11: (None, None), 12: (None, None)}
-    BAGROT_COLOR = ['FF0000FF']
-    TEST_COLOR = ['00000000']
-    INSIDE_BAGROT_COLOR = ['FF3D85C6', 'FF6D9EEB']
-    DATE_COLUMN = 'E'
-
-    def __init__(self, workbook_path: str, intervals):
-        self.workbook_path = workbook_path
-        self.workbook = load_workbook(self.workbook_path, read_only=True)
-        self.worksheet = self.workbook['תשפ"ב']
-        self.schedule: dict[int, list[list[Event]]] = dict()
-        self.expire_date: datetime.date = datetime.date.today()
+    DOWNLOAD_TIMEOUT = 30  # seconds
+    CHUNK_SIZE = 64 * 1024
+    MOCK_PREFIX = 'מתכ.'
+    RETRY_AFTER_FAILURE = datetime.timedelta(minutes=10)  # after a refresh that failed to parse the workbook
 
+    def __init__(self, source: WorkbookSource, intervals, cache_policy: CachePolicy = CachePolicy(),
+                 core: Optional[AsyncCore] = None, parse_cache: Optional[ParseCache] = None):
+        self.source = source
+        self.workbook_path = source.workbook_path
+        self.download_url = source.download_url
+        self.core = core  # refreshes in the background on the core's event loop when given, else on a thread
+        self.parse_cache = parse_cache if parse_cache is not None else ParseCache()
+        self.GRADES: dict[int, list[int]] = {}
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.content_hash: str = self.file_hash(self.workbook_path)
+        self.cache = ScheduleCache(f'{self.workbook_path}.cache')
+        self.workbook = None
+        self.worksheet = None
+        # (version, schedule), swapped as one so readers never see a version with another schedule
+        self.snapshot: tuple[int, dict[int, list[list[Event]]]] = (0, dict())
+        self.events: dict[int, dict[int, list[Event]]] = dict()
+        self.row_dates: dict[int, datetime.date] = dict()
+        self.date_rows: list[int] = []
+        self.event_index = EventIndex({})
+        # called with (old event index, new event index) after a refresh brought a changed workbook
+        self.change_listeners: list[Callable[[EventIndex, EventIndex], None]] = []
+        self.cache_policy = cache_policy
+        self.expires_at: datetime.datetime = datetime.datetime.now()
+        self.week_start: Optional[datetime.date] = None
+        self._state_lock = threading.RLock()  # guards the parsed workbook while it is swapped
+        self._refresh_lock = threading.Lock()  # held while a refresh is running
+
+        if self.load_cache():
+            # serve the cached schedule right away, the download may take up to `DOWNLOAD_TIMEOUT`
+            self.build_schedule(intervals)
+            self.refresh_in_background(intervals)
+            return
+        self.open_worksheet()
         self.set_grades_columns()
+        self.parse_sheet()
+        self.save_cache()
+        self.build_schedule(intervals)  # served as is if the first refresh fails
         self.update_schedule(intervals)
 
     def open_worksheet(self):
-        self.workbook = load_workbook(self.workbook_path, read_only=True)
-        self.worksheet = self.workbook.active
+        self.workbook = self.source.open_workbook(self.workbook_path)
+        self.worksheet = self.source.worksheet(self.workbook)
+
+    @property
+    def cache_key(self) -> str:
+        return self.parsed_key(self.content_hash)
+
+    def load_cache(self) -> bool:
+        """
+        loads the parsed workbook from the cache if it matches the workbook's content
+        :return: whether the cache was loaded
+        """
+        cached = self.cache.load(self.cache_key)
+        if cached is None:
+            return False
+        with self._state_lock:
+            self.GRADES = cached['grades']
+            self.events = cached['events']
+            self.row_dates = cached['row_dates']
+            self.etag = cached['etag']
+            self.last_modified = cached['last_modified']
+            self.index_dates()
+            self.index_events()
+        return True
+
+    def save_cache(self):
+        try:
+            self.cache.save(self.cache_key, {
+                'grades': self.GRADES,
+                'events': self.events,
+                'row_dates': self.row_dates,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+            })
+        except OSError as e:
+            logger.warning('Failed to save the schedule cache: %s', e)
 
     def set_grades_columns(self):
         """
@@ -39,7 +213,7 @@ class ExcelWorker:
         """
         grades = {9: [], 10: [], 11: [], 12: []}
 
-        for row in self.worksheet.iter_rows(min_row=self.GRADES_ROW, max_row=self.GRADES_ROW):
+        for row in self.worksheet.iter_rows(min_row=self.source.grades_row, max_row=self.source.grades_row):
             for column in row:
                 if column.value is None:
                     continue
@@ -54,80 +228,349 @@ class ExcelWorker:
 
         self.GRADES = grades
 
-    def get_this_week_row(self):
+    @staticmethod
+    def get_this_week_sunday() -> datetime.date:
         today = datetime.date.today()
-        sunday = today - \
-            datetime.timedelta((today.weekday() + 1) % 7)  # 6 = sunday
-        for cells in self.worksheet.iter_rows(max_col=column_index_from_string(self.DATE_COLUMN),
-                                              min_col=column_index_from_string(
-                                                  self.DATE_COLUMN),
-                                              min_row=3):
-            cell: openpyxl.cell.cell.Cell = cells[0]
-            if sunday == cell.value.date():
-                return cell.row
-
-    def parse_today_events(self, row: tuple) -> list:
-        events = []
-        for event in row:
-            if event and event.value and event not in events:
-                events.append(event)
-        return events
-
-    def get_week_events(self, starting_col, grade) -> list[Event]:
-        events: list[Event] = []
-        for cells in self.worksheet.iter_rows(min_row=starting_col, max_row=starting_col + 5,
-                                              min_col=self.GRADES[grade][0],
-                                              max_col=self.GRADES[grade][1]):
-
-            for cell in self.parse_today_events(cells):
-                if not cell.value:  # cell is empty
-                    continue
-                date = self.worksheet[f'{self.DATE_COLUMN}{cell.row}'].value.date(
-                )
-                if cell.value.startswith('מתכ.'):
-                    events.append(
-                        Event(cell.value[4:].strip(" "), "מתכונת", date))
-                elif cell.fill.start_color.index in self.BAGROT_COLOR:
-                    events.append(Event(cell.value.strip(" "), "בגרות", date))
-                elif cell.fill.start_color.index in self.INSIDE_BAGROT_COLOR:
-                    events.append(
-                        Event(cell.value.strip(" "), "בגרות פנימית", date))
-                elif cell.fill.start_color.index in self.TEST_COLOR:
-                    events.append(
-                        Event(cell.value.strip(" "), "מבחן", date))
-                else:
-                    events.append(Event(cell.value.strip(" "), "", date))
+        return today - datetime.timedelta((today.weekday() + 1) % 7)  # 6 = sunday
 
-        return events
+    def index_dates(self):
+        """
+        orders the rows of `self.row_dates` by date, the event index is built in this order
+        :return: None, assigns the result to `self.date_rows`
+        """
+        self.date_rows = [row for _, row in sorted((date, row) for row, date in self.row_dates.items())]
+
+    def index_events(self):
+        """
+        builds the per-grade, date-sorted event index out of `self.events`
+        :return: None, assigns the result to `self.event_index`
+        """
+        self.event_index = EventIndex({grade: [event for row in self.date_rows for event in rows.get(row, ())]
+                                       for grade, rows in self.events.items()})
+
+    @classmethod
+    def classify_event(cls, cell, date: datetime.date, fill_types: dict[str, EventType]) -> Event:
+        """
+        :param fill_types: the event type of every exam fill color, see `WorkbookSource.fill_types`
+        """
+        if cell.value.startswith(cls.MOCK_PREFIX):
+            return Event(cell.value[len(cls.MOCK_PREFIX):].strip(" "), EventType.MOCK_BAGROT, date)
+        return Event(cell.value.strip(" "), fill_types.get(cell.fill.start_color.index, EventType.OTHER), date)
+
+    @classmethod
+    def classify_block(cls, cells: tuple, date: datetime.date, fill_types: dict[str, EventType]) -> list[Event]:
+        """
+        :param cells: the cells of one grade on one day
+        :return: an event for every non empty text cell. a merged range only has a value in its first cell,
+            so it is read once. numbers and dates in a grade's columns aren't events and are skipped
+        """
+        classify = cls.classify_event
+        return [classify(cell, date, fill_types) for cell in cells if cell.value and isinstance(cell.value, str)]
+
+    @classmethod
+    def read_sheet(cls, worksheet, grades: dict,
+                   source: WorkbookSource) -> tuple[dict[int, dict[int, list[Event]]], dict[int, datetime.date]]:
+        """
+        reads the whole worksheet in a single pass, collecting the events
+        of every grade together with the date of every row
+        :param grades: the columns of every grade, see `set_grades_columns`
+        :param source: the layout of the worksheet
+        :return: the events of every grade by row, and the date of every row
+        """
+        events: dict[int, dict[int, list[Event]]] = {grade: {} for grade in grades}
+        row_dates: dict[int, datetime.date] = {}
+        date_column = column_index(source.date_column)
+        max_col = max(columns[1] for columns in grades.values())
+        fill_types = source.fill_types()
+        blocks = [(events[grade], first - 1, last) for grade, (first, last) in grades.items()]
+
+        for cells in worksheet.iter_rows(min_row=source.grades_row + 1,
+                                         max_col=max(max_col, date_column)):
+            if len(cells) < date_column:
+                continue
+            date_cell = cells[date_column - 1]
+            if not isinstance(date_cell.value, datetime.datetime):
+                continue
+            date = date_cell.value.date()
+            row_dates[date_cell.row] = date
+
+            for grade_events, start, stop in blocks:
+                day_events = cls.classify_block(cells[start:stop], date, fill_types)
+                if day_events:
+                    grade_events[date_cell.row] = day_events
+
+        return events, row_dates
+
+    def parse_sheet(self):
+        """
+        parses `self.worksheet`
+        :return: None, assigns the result to `self.events` and `self.row_dates`
+        """
+        self.set_parsed(*self.read_sheet(self.worksheet, self.GRADES, self.source))
+        self.parse_cache.put(self.source.name, self.cache_key, (self.GRADES, self.events, self.row_dates))
+
+    def set_parsed(self, events: dict[int, dict[int, list[Event]]], row_dates: dict[int, datetime.date]):
+        with self._state_lock:
+            self.events = events
+            self.row_dates = row_dates
+            self.index_dates()
+            self.index_events()
+
+    def get_week_events(self, starting_date: datetime.date, grade) -> list[Event]:
+        return self.event_index.between(grade, starting_date, starting_date + datetime.timedelta(days=5))
+
+    def download_workbook(self) -> Optional[Download]:
+        """
+        downloads the excel with a conditional GET, streaming it into a temporary file next to `self.workbook_path`.
+        the file doesn't replace the workbook here, see `install`
+        :return: the download if the content of the workbook changed, else None
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        with DOWNLOAD_SECONDS.time(), \
+                requests.get(self.download_url, headers=headers, stream=True, timeout=self.DOWNLOAD_TIMEOUT) as response:
+            if response.status_code == 304:  # not modified
+                return None
+            response.raise_for_status()
+
+            digest = hashlib.sha256()
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp.xlsx',  # openpyxl goes by the extension
+                                             dir=os.path.dirname(os.path.abspath(self.workbook_path)))
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    for chunk in response.iter_content(self.CHUNK_SIZE):
+                        digest.update(chunk)
+                        temp_file.write(chunk)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+        content_hash = digest.hexdigest()
+        if content_hash == self.content_hash:
+            os.remove(temp_path)
+            self.etag = etag
+            self.last_modified = last_modified
+            return None
+        return Download(temp_path, content_hash, etag, last_modified)
+
+    def parsed_key(self, content_hash: str) -> str:
+        return f'{content_hash}:{self.source.layout_key()}'
+
+    def install(self, download: Download, parsed: tuple):
+        """
+        replaces the workbook with a download that was parsed into `parsed` (grades, events, row dates),
+        so a download that fails to parse never replaces a good workbook, neither in memory nor on disk
+        """
+        grades, events, row_dates = parsed
+        if self.workbook is not None:
+            self.workbook.close()  # the workbook holds the file open
+            self.workbook = self.worksheet = None
+        os.replace(download.path, self.workbook_path)
+        with self._state_lock:
+            self.content_hash = download.content_hash
+            self.etag = download.etag
+            self.last_modified = download.last_modified
+            self.GRADES = grades
+            self.set_parsed(events, row_dates)
+        self.parse_cache.put(self.source.name, self.cache_key, parsed)
+        self.save_cache()
+
+    @staticmethod
+    def discard(download: Download):
+        if os.path.exists(download.path):
+            os.remove(download.path)
+
+    def refresh_workbook(self) -> bool:
+        """
+        downloads the excel and reparses it if it changed
+        :return: whether the workbook was reparsed
+        :raise Exception: if the new workbook failed to parse, the current one is kept
+        """
+        try:
+            download = self.download_workbook()
+        except (requests.RequestException, OSError) as e:
+            logger.warning('Failed to download the excel, keeping the current one: %s', e)
+            return False
+        if download is None:
+            return False
+
+        try:
+            parsed = self.parse_cache.get(self.source.name, self.parsed_key(download.content_hash))
+            if parsed is None:
+                with PARSE_SECONDS.time():
+                    parsed = (self.GRADES, *parse_workbook(download.path, self.GRADES, self.source))
+            self.install(download, parsed)
+        finally:
+            self.discard(download)
+        return True
+
+    def build_schedule(self, intervals: list[int]):
+        """
+        slices the parsed workbook into the weeks of `intervals` (in days) starting at this week's sunday
+        :return: None, swaps the result into `self.snapshot` under a new version
+        """
+        sunday = self.get_this_week_sunday()
+        # under the lock, so two rebuilds (a handler's at the week boundary and a refresh's) can't both publish
+        # the same version with different schedules
+        with self._state_lock:
+            schedule = {grade: [self.get_week_events(sunday + datetime.timedelta(days=week_interval), grade)
+                                for week_interval in intervals]
+                        for grade in self.GRADES}
+            self.snapshot = (self.snapshot[0] + 1, schedule)
+            self.week_start = sunday
+
+    async def refresh_workbook_async(self) -> bool:
+        """
+        same as `refresh_workbook` but on `self.core`: the download runs off the event loop
+        and the parse runs in its process pool
+        """
+        try:
+            download = await self.core.run_blocking(self.download_workbook)
+        except (requests.RequestException, OSError) as e:
+            logger.warning('Failed to download the excel, keeping the current one: %s', e)
+            return False
+        if download is None:
+            return False
+
+        try:
+            parsed = self.parse_cache.get(self.source.name, self.parsed_key(download.content_hash))
+            if parsed is None:
+                with PARSE_SECONDS.time():
+                    parsed = (self.GRADES, *await self.core.run_cpu(parse_workbook, download.path, self.GRADES,
+                                                                     self.source))
+            await self.core.run_blocking(self.install, download, parsed)
+        finally:
+            self.discard(download)
+        return True
 
     def update_schedule(self, intervals: list[int]):
+        old_index = self.event_index
+        start = time.perf_counter()
         # get the most up-to-date version of the excel
-        self.workbook.close()
-        file = requests.get(DOWNLOAD_URL)
-        with open(self.workbook_path, 'wb') as excel_file:
-            excel_file.write(file.content)
+        try:
+            changed = self.refresh_workbook()
+        except Exception:
+            self.refresh_failed()
+            return
+        self.finish_update(intervals, old_index, changed, start)
+
+    async def update_schedule_async(self, intervals: list[int]):
+        old_index = self.event_index
+        start = time.perf_counter()
+        try:
+            changed = await self.refresh_workbook_async()
+        except Exception:
+            self.refresh_failed()
+            return
+        # the change listeners may broadcast, keep them off the event loop
+        await self.core.run_blocking(self.finish_update, intervals, old_index, changed, start)
+
+    def refresh_failed(self):
+        """
+        keeps serving the current schedule and tries again after `RETRY_AFTER_FAILURE`, rather than downloading
+        and parsing the broken workbook on every lookup. call it while handling the exception
+        """
+        self.expires_at = datetime.datetime.now() + self.RETRY_AFTER_FAILURE
+        logger.exception('Failed to refresh the schedule, keeping the current one until %s', self.expires_at)
+        log_event('refresh', failed=True, version=self.version, content_hash=self.content_hash,
+                  expires_at=self.expires_at)
+
+    def finish_update(self, intervals: list[int], old_index: EventIndex, changed: bool, start: float):
+        """
+        swaps in the schedule of the refreshed workbook and lets the change listeners know if it changed
+        """
+        self.build_schedule(intervals)
+        self.expires_at = self.cache_policy.expires_at(datetime.datetime.now())
+        log_event('refresh', changed=changed, seconds=round(time.perf_counter() - start, 4),
+                  version=self.version, content_hash=self.content_hash, expires_at=self.expires_at)
+
+        if changed:
+            for listener in self.change_listeners:
+                try:
+                    listener(old_index, self.event_index)
+                except Exception:
+                    logger.exception('Failed to handle the schedule change')
+
+    def refresh_in_background(self, intervals: list[int]):
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # a refresh is already running
+
+        if self.core is not None:
+            def done(future):
+                self._refresh_lock.release()
+                if future.exception() is not None:
+                    logger.error('Failed to refresh the schedule', exc_info=future.exception())
+
+            self.core.submit(self.update_schedule_async(intervals)).add_done_callback(done)
+            return
+
+        def refresh():
+            try:
+                self.update_schedule(intervals)
+            except Exception:
+                logger.exception('Failed to refresh the schedule')
+            finally:
+                self._refresh_lock.release()
 
-        self.open_worksheet()  # refresh the worksheet
+        threading.Thread(target=refresh, name='schedule-refresh', daemon=True).start()
 
-        row = self.get_this_week_row()
-        for grade in self.GRADES:
-            self.schedule[grade] = []
-        for grade in self.GRADES:
-            for week_interval in intervals:
-                self.schedule[grade].append(
-                    self.get_week_events(row + week_interval, grade))
+    @property
+    def schedule(self) -> dict[int, list[list[Event]]]:
+        return self.snapshot[1]
 
-        self.expire_date = datetime.date.today() \
-            + datetime.timedelta(days=intervals[0] * 7)
+    @property
+    def version(self) -> int:
+        return self.snapshot[0]
+
+    def get_schedule_snapshot(self, intervals: list[int]) -> tuple[int, dict[int, list[list[Event]]]]:
+        """
+        :return: the current schedule together with its version, refreshing it according to `self.cache_policy`
+        """
+        now = datetime.datetime.now()
+        if now < self.expires_at:
+            SCHEDULE_LOOKUPS.inc(result='fresh')
+            return self.snapshot
+
+        # a new week started, the parsed workbook only needs to be sliced again
+        if self.week_start != self.get_this_week_sunday():
+            self.build_schedule(intervals)
+
+        if now < self.expires_at + self.cache_policy.stale_while_revalidate:
+            SCHEDULE_LOOKUPS.inc(result='stale')
+            self.refresh_in_background(intervals)
+            return self.snapshot
+
+        SCHEDULE_LOOKUPS.inc(result='expired')
+        logger.info('Getting new schedule')
+        with self._refresh_lock:
+            if datetime.datetime.now() >= self.expires_at:
+                if self.core is not None:
+                    # the download and the parse run on the core like any refresh, this thread only waits
+                    self.core.submit(self.update_schedule_async(intervals)).result()
+                else:
+                    self.update_schedule(intervals)
+        return self.snapshot
 
     def get_schedule(self, intervals: list[int]) -> dict[int, list[list[Event]]]:
-        # before updating check if schedule's last date
-        # hasn't expired
-        if self.expire_date >= datetime.date.today():
-            return self.schedule
-        print('Getting new schedule')
-        self.update_schedule(intervals)
-        return self.schedule
+        return self.get_schedule_snapshot(intervals)[1]
+
+    def get_event_index(self, intervals: list[int]) -> EventIndex:
+        self.get_schedule_snapshot(intervals)  # refresh the workbook if needed
+        return self.event_index
+
+    @classmethod
+    def file_hash(cls, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
 
     @staticmethod
     def grade_to_number(grade: str) -> int:
@@ -135,3 +578,16 @@ class ExcelWorker:
         for letter in grade:
             n += ord(letter) - ord('א') + 1
         return n
+
+
+def parse_workbook(workbook_path: str, grades: dict,
+                   source: WorkbookSource) -> tuple[dict[int, dict[int, list[Event]]], dict[int, datetime.date]]:
+    """
+    parses the worksheet of the workbook at `workbook_path`, a module level function
+    so it can run in a worker process
+    """
+    workbook = source.open_workbook(workbook_path)
+    try:
+        return ExcelWorker.read_sheet(source.worksheet(workbook), grades, source)
+    finally:
+        workbook.close()
@@ -0,0 +1,33 @@
+"""
+a stand-in for `telegram.Bot` that the benchmark, the admin's replay and the tests send through
+"""
+import random
+import threading
+import time
+
+from telegram.error import RetryAfter
+
+
+class FakeBot:
+    """
+    stands in for `telegram.Bot`, records when every message was sent.
+    with a `flood_rate`, that share of the sends is refused with telegram's flood control error
+    """
+
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, retry_after: float = 1, seed: int = 0):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.floods = 0
+        self.rand = random.Random(seed)
+        self.sent: list[tuple[str, float]] = []
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, **_):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if self.flood_rate and self.rand.random() < self.flood_rate:
+                self.floods += 1
+                raise RetryAfter(self.retry_after)
+            self.sent.append((chat_id, time.perf_counter()))
@@ -1,12 +1,15 @@
 from creds import BOT_TOKEN, DEV_TOKEN
 from bot import Bot
 TEST = False
+METRICS_PORT = 9100
+BROADCAST_WORKERS = 4
 
 
 def main():
     excel_path = '../לוח מבחנים.xlsx'
     bot = Bot(DEV_TOKEN if TEST else BOT_TOKEN,
-              '../userdata.json', excel_path, True)
+              '../userdata.json', excel_path, True, metrics_port=METRICS_PORT,
+              broadcast_workers=BROADCAST_WORKERS)
     bot.run()
 
 
@@ -0,0 +1,177 @@
+"""
+in-process metrics exposed in the prometheus text format, and a structured (json lines) log of
+the refresh and broadcast runs
+"""
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import threading
+import time
+
+events_logger = logging.getLogger('yth.events')
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key: LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, documentation: str, registry: 'Registry' = None):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return '\n'.join([f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}'] +
+                         self.samples())
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name: str, documentation: str, registry: 'Registry' = None):
+        super().__init__(name, documentation, registry)
+        self.values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(label_key(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            return [f'{self.name}{format_labels(key)} {value}' for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    TYPE = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+    BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = BUCKETS,
+                 registry: 'Registry' = None):
+        super().__init__(name, documentation, registry)
+        self.buckets = buckets
+        self.counts: dict[LabelKey, list[int]] = {}  # one count per bucket, then +Inf
+        self.sums: dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = label_key(labels)
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.sums[key] = self.sums.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        with self.lock:
+            for key, counts in self.counts.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{format_labels(key, (("le", le),))} {cumulative}')
+                lines.append(f'{self.name}_sum{format_labels(key)} {self.sums[key]}')
+                lines.append(f'{self.name}_count{format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+DOWNLOAD_SECONDS = Histogram('yth_workbook_download_seconds', 'Time spent downloading the workbook')
+PARSE_SECONDS = Histogram('yth_workbook_parse_seconds', 'Time spent parsing the workbook')
+SCHEDULE_LOOKUPS = Counter('yth_schedule_lookups_total',
+                           'get_schedule lookups by result: fresh, stale (served while refreshing) or expired')
+HANDLER_SECONDS = Histogram('yth_handler_seconds', 'Latency of the telegram handlers')
+HANDLER_ERRORS = Counter('yth_handler_errors_total', 'Exceptions raised by the telegram handlers')
+SEND_SECONDS = Histogram('yth_broadcast_send_seconds', 'Latency of a single broadcast send_message call')
+BROADCAST_MESSAGES = Counter('yth_broadcast_messages_total', 'Broadcast messages by result: sent, retried, failed or unknown')
+QUEUE_DEPTH = Gauge('yth_broadcast_queue_depth', 'Broadcast messages waiting to be sent')
+
+
+def log_event(kind: str, **fields):
+    """
+    writes a structured, single line json record of a refresh / broadcast run
+    """
+    events_logger.info(json.dumps({'event': kind, 'time': time.time(), **fields}, default=str, ensure_ascii=False))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    serves the metrics on http://host:port/metrics from a background thread
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
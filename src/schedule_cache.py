@@ -0,0 +1,38 @@
+from typing import Optional
+import os
+import pickle
+import tempfile
+
+
+class ScheduleCache:
+    """
+    an on-disk cache of a parsed workbook, keyed by the workbook's content hash
+    """
+    VERSION = 2
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, content_hash: str) -> Optional[dict]:
+        """
+        :return: the cached data, or None if the cache is missing, outdated or belongs to another workbook
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                version, cached_hash, data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError, ImportError):
+            return None
+        if version != self.VERSION or cached_hash != content_hash:
+            return None
+        return data
+
+    def save(self, content_hash: str, data: dict):
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((self.VERSION, content_hash, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
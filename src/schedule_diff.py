@@ -0,0 +1,53 @@
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+import datetime
+from event import Event
+
+
+@dataclass
+class ScheduleDiff:
+    added: list[Event] = field(default_factory=list)
+    removed: list[Event] = field(default_factory=list)
+    moved: list[tuple[Event, Event]] = field(default_factory=list)  # (old, new)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved)
+
+    def within(self, start: datetime.date, end: datetime.date) -> 'ScheduleDiff':
+        """
+        :return: the changes that touch the dates between `start` and `end` (inclusive),
+                 a moved event is kept if either its old or its new date is in range
+        """
+        def in_range(event: Event) -> bool:
+            return start <= event.date <= end
+
+        return ScheduleDiff([event for event in self.added if in_range(event)],
+                            [event for event in self.removed if in_range(event)],
+                            [(old, new) for old, new in self.moved if in_range(old) or in_range(new)])
+
+
+def diff_events(old: list[Event], new: list[Event]) -> ScheduleDiff:
+    """
+    compares two versions of a grade's events, an event that was removed and added again
+    with the same name and type on another date is reported as moved
+    """
+    old_counts, new_counts = Counter(old), Counter(new)
+    removed = list((old_counts - new_counts).elements())
+    added = list((new_counts - old_counts).elements())
+
+    # pair removed and added events of the same name and type, in date order
+    removed_by_key: dict[tuple, list[Event]] = defaultdict(list)
+    for event in sorted(removed, key=lambda e: e.date):
+        removed_by_key[(event.name, event.type_)].append(event)
+
+    diff = ScheduleDiff()
+    for event in sorted(added, key=lambda e: e.date):
+        candidates = removed_by_key.get((event.name, event.type_))
+        if candidates:
+            diff.moved.append((candidates.pop(0), event))
+        else:
+            diff.added.append(event)
+    diff.removed = [event for events in removed_by_key.values() for event in events]
+    diff.removed.sort(key=lambda e: e.date)
+    return diff
+
@@ -0,0 +1,51 @@
+from typing import Iterator, Optional
+import threading
+from async_core import AsyncCore
+from excel_handler import CachePolicy, ExcelWorker, ParseCache, WorkbookSource
+
+
+class SourceRegistry:
+    """
+    the workbook sources (schools / school years) served by this process, every source has its own
+    `ExcelWorker` while all of them fetch and parse on one `AsyncCore` and share one `ParseCache`
+    """
+
+    def __init__(self, intervals: list[int], core: Optional[AsyncCore] = None,
+                 parse_cache: Optional[ParseCache] = None, cache_policy: CachePolicy = CachePolicy()):
+        self.intervals = intervals
+        self.core = core
+        self.parse_cache = parse_cache if parse_cache is not None else ParseCache()
+        self.cache_policy = cache_policy
+        self.workers: dict[str, ExcelWorker] = {}
+        self.adding: set[str] = set()  # the names of the sources whose worker is being created
+        self.lock = threading.Lock()
+
+    def add(self, source: WorkbookSource) -> ExcelWorker:
+        """
+        starts serving `source`, loading (or parsing) its workbook
+        :return: the worker of the source
+        :raise ValueError: if a source with the same name is registered (or being added)
+        """
+        with self.lock:
+            if source.name in self.workers or source.name in self.adding:
+                raise ValueError(f'source {source.name!r} is already registered')
+            # the name is reserved while the worker loads, outside the lock since that may download and parse
+            self.adding.add(source.name)
+        try:
+            worker = ExcelWorker(source, self.intervals, cache_policy=self.cache_policy,
+                                 core=self.core, parse_cache=self.parse_cache)
+            with self.lock:
+                self.workers[source.name] = worker
+        finally:
+            with self.lock:
+                self.adding.discard(source.name)
+        return worker
+
+    def __getitem__(self, name: str) -> ExcelWorker:
+        return self.workers[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.workers
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.workers))
@@ -0,0 +1,253 @@
+from typing import Callable, Iterable, Iterator, Optional
+import itertools
+import json
+import os
+import sqlite3
+import threading
+
+
+class UserStore:
+    """
+    maps a chat id to the user's info: {'grade': int, 'days': int, 'wantsUpdate': bool}, and optionally when the
+    user gets the digest, {'digestDay': int (0 = monday), 'digestTime': 'HH:MM'}, and whether they get a reminder
+    the day before an exam, {'reminders': bool}.
+    a user that hasn't finished the setup may be missing some of the fields.
+    the subscribed users are also indexed by their segment, (grade, weeks).
+    a subclass persists every change in `write(chat_id, info)`, called with `self.lock` held
+    """
+    FIELDS = ('grade', 'days', 'wantsUpdate', 'digestDay', 'digestTime', 'reminders')
+
+    def __init__(self):
+        self.users: dict[str, dict] = {}
+        self.segments_index: dict[tuple[int, int], set[str]] = {}
+        self.lock = threading.RLock()
+        self.listeners: list[Callable[[str], None]] = []  # called with the chat id after a user changed
+
+    def __contains__(self, chat_id: str) -> bool:
+        return chat_id in self.users
+
+    def __getitem__(self, chat_id: str) -> dict:
+        return dict(self.users[chat_id])
+
+    def __setitem__(self, chat_id: str, info: dict):
+        info = {field: info[field] for field in self.FIELDS if info.get(field) is not None}
+        with self.lock:
+            old_info = self.users.get(chat_id)
+            self.users[chat_id] = info
+            self.write(chat_id, info)
+            self.unindex(chat_id, old_info)
+            self.index(chat_id, info)
+        for listener in self.listeners:
+            listener(chat_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.users))
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def get(self, chat_id: str, default: Optional[dict] = None) -> Optional[dict]:
+        return self[chat_id] if chat_id in self else default
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        for chat_id in self:
+            info = self.users.get(chat_id)
+            if info is not None:
+                yield chat_id, dict(info)
+
+    def update(self, chat_id: str, **fields):
+        """
+        changes some of the fields of an existing user
+        """
+        with self.lock:
+            self[chat_id] = {**self.users[chat_id], **fields}
+
+    @staticmethod
+    def segment(info: dict) -> Optional[tuple[int, int]]:
+        """
+        :return: the (grade, weeks) the user is subscribed to, or None if they don't get automatic updates
+        """
+        if 'grade' not in info or 'days' not in info or not info.get('wantsUpdate'):
+            return None
+        return info['grade'], info['days'] // 7
+
+    def index(self, chat_id: str, info: Optional[dict]):
+        segment = self.segment(info) if info else None
+        if segment is not None:
+            self.segments_index.setdefault(segment, set()).add(chat_id)
+
+    def unindex(self, chat_id: str, info: Optional[dict]):
+        segment = self.segment(info) if info else None
+        if segment is not None:
+            chat_ids = self.segments_index[segment]
+            chat_ids.discard(chat_id)
+            if not chat_ids:
+                del self.segments_index[segment]
+
+    def reindex(self):
+        with self.lock:
+            self.segments_index = {}
+            for chat_id, info in self.users.items():
+                self.index(chat_id, info)
+
+    def subscribers(self, grade: int, weeks: int) -> list[str]:
+        with self.lock:
+            return list(self.segments_index.get((grade, weeks), ()))
+
+    def segments(self) -> dict[tuple[int, int], list[str]]:
+        """
+        :return: the subscribed chat ids of every (grade, weeks)
+        """
+        with self.lock:
+            return {segment: list(chat_ids) for segment, chat_ids in self.segments_index.items()}
+
+    def close(self):
+        pass
+
+
+class SqliteUserStore(UserStore):
+    """
+    keeps the users in a sqlite database in WAL mode, every change writes only the changed user
+    """
+    COLUMNS = {'grade': 'INTEGER', 'days': 'INTEGER', 'wants_update': 'INTEGER',
+               'digest_day': 'INTEGER', 'digest_time': 'TEXT', 'reminders': 'INTEGER'}
+
+    SELECT = 'SELECT chat_id, grade, days, wants_update, digest_day, digest_time, reminders FROM users'
+    INSERT = 'INSERT OR REPLACE INTO users (chat_id, grade, days, wants_update, digest_day, digest_time, reminders) ' \
+             'VALUES (?, ?, ?, ?, ?, ?, ?)'
+
+    def __init__(self, filepath: str):
+        super().__init__()
+        self.filepath = filepath
+        self.connection = self.connect(filepath)
+        for row in self.connection.execute(self.SELECT):
+            chat_id, info = self.from_row(row)
+            self.users[chat_id] = info
+        self.reindex()
+
+    @classmethod
+    def connect(cls, filepath: str) -> sqlite3.Connection:
+        """
+        opens the database and creates (or migrates) the users table
+        """
+        connection = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS users ('
+                           'chat_id TEXT PRIMARY KEY, grade INTEGER, days INTEGER, wants_update INTEGER)')
+        existing = {row[1] for row in connection.execute('PRAGMA table_info(users)')}
+        for column, column_type in cls.COLUMNS.items():
+            if column not in existing:  # added after the table was created
+                connection.execute(f'ALTER TABLE users ADD COLUMN {column} {column_type}')
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        return connection
+
+    @staticmethod
+    def from_row(row: tuple) -> tuple[str, dict]:
+        chat_id, grade, days, wants_update, digest_day, digest_time, reminders = row
+        info = {'grade': grade, 'days': days,
+                'wantsUpdate': None if wants_update is None else bool(wants_update),
+                'digestDay': digest_day, 'digestTime': digest_time,
+                'reminders': None if reminders is None else bool(reminders)}
+        return chat_id, {field: value for field, value in info.items() if value is not None}
+
+    @staticmethod
+    def to_row(chat_id: str, info: dict) -> tuple:
+        wants_update = info.get('wantsUpdate')
+        reminders = info.get('reminders')
+        return (chat_id, info.get('grade'), info.get('days'), None if wants_update is None else int(wants_update),
+                info.get('digestDay'), info.get('digestTime'), None if reminders is None else int(reminders))
+
+    def write(self, chat_id: str, info: dict):
+        """
+        persists a single user, called with `self.lock` held
+        """
+        self.connection.execute(self.INSERT, self.to_row(chat_id, info))
+
+    def migrated(self, source: str) -> bool:
+        """
+        :return: whether `source` was migrated into the store, see `migrate`
+        """
+        return self.connection.execute('SELECT 1 FROM meta WHERE key = ?',
+                                       (f'migrated:{source}',)).fetchone() is not None
+
+    def migrate(self, source: str, users: dict[str, dict]):
+        """
+        imports the users of a legacy store in a single transaction, which also records that `source` was migrated,
+        so an interrupted migration is simply done again. users the store already has (e.g. written by
+        `write_users` before the first run) are newer than `source` and are kept
+        """
+        with self.lock:
+            before = dict(self.users)
+            self.connection.execute('BEGIN')
+            try:
+                for chat_id, info in users.items():
+                    if str(chat_id) not in self.users:
+                        self[str(chat_id)] = info
+                self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                        (f'migrated:{source}', str(len(users))))
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                self.users = before
+                self.reindex()
+                raise
+            self.connection.execute('COMMIT')
+
+    def close(self):
+        self.connection.close()
+
+
+def iter_users(filepath: str, batch_size: int = 1000) -> Iterator[tuple[str, dict]]:
+    """
+    streams the users of the sqlite store at `filepath`, `batch_size` rows at a time, without loading the store
+    """
+    connection = SqliteUserStore.connect(filepath)
+    try:
+        cursor = connection.execute(SqliteUserStore.SELECT + ' ORDER BY chat_id')
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                yield SqliteUserStore.from_row(row)
+    finally:
+        connection.close()
+
+
+def write_users(filepath: str, users: Iterable[tuple[str, dict]], batch_size: int = 1000) -> int:
+    """
+    writes (replaces) users into the sqlite store at `filepath`, a transaction per `batch_size` users, without
+    loading the store. a running bot only sees them after a restart
+    :return: the number of users written
+    """
+    connection = SqliteUserStore.connect(filepath)
+    users = iter(users)
+    written = 0
+    try:
+        while batch := [SqliteUserStore.to_row(str(chat_id), info)
+                        for chat_id, info in itertools.islice(users, batch_size)]:
+            connection.execute('BEGIN')
+            try:
+                connection.executemany(SqliteUserStore.INSERT, batch)
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            written += len(batch)
+    finally:
+        connection.close()
+    return written
+
+
+def open_user_store(filepath: str) -> UserStore:
+    """
+    opens the sqlite user store at `filepath`, given the path of a legacy `userdata.json`
+    the store is kept next to it (`userdata.db`) and the json is migrated into it the first time
+    """
+    root, extension = os.path.splitext(filepath)
+    if extension != '.json':
+        return SqliteUserStore(filepath)
+
+    store = SqliteUserStore(root + '.db')
+    source = os.path.basename(filepath)
+    if os.path.exists(filepath) and not store.migrated(source):
+        with open(filepath) as f:
+            store.migrate(source, json.load(f))
+    return store
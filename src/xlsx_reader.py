@@ -0,0 +1,417 @@
+"""
+a minimal xlsx reader, a fast alternative to `openpyxl.load_workbook(read_only=True)` for what `ExcelWorker` reads:
+cell values (strings, numbers and dates) and fill colors.
+the sheet xml is streamed out of the zip with an incremental parser, the shared strings are only read once a
+string cell is met, and a cell's fill is only looked up when it is asked for.
+the cells mimic openpyxl's read only cells, so the same parsing code runs on either
+"""
+from dataclasses import dataclass
+from typing import Iterator, Optional, Union
+from xml.etree.ElementTree import iterparse
+import datetime
+import logging
+import posixpath
+import re
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+WINDOWS_EPOCH = datetime.datetime(1899, 12, 30)
+MAC_EPOCH = datetime.datetime(1904, 1, 1)
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# the builtin number formats that openpyxl knows as dates, and as durations
+BUILTIN_DATE_FORMATS = {14, 15, 16, 17, 18, 19, 20, 21, 22, 45, 46, 47}
+BUILTIN_TIMEDELTA_FORMATS = {46}
+# same as openpyxl.styles.numbers
+STRIP_FORMAT = re.compile(r'".*?"|\[(?!hh?\]|mm?\]|ss?\])[^\]]*\]')
+DATE_FORMAT = re.compile(r'[^\\][dmhysDMHYS]')
+TIMEDELTA_FORMAT = re.compile(r'\[hh?\](:mm(:ss(\.0*)?)?)?|\[mm?\](:ss(\.0*)?)?|\[ss?\](\.0*)?', re.I)
+COORDINATE = re.compile(r'([A-Z]+)(\d+)')
+
+
+def local_name(tag: str) -> str:
+    """
+    :return: the tag without its namespace, so both the transitional and the strict xlsx namespaces work
+    """
+    return tag.rpartition('}')[2]
+
+
+def column_index(letters: str) -> int:
+    """
+    :return: the 1 based index of a column, e.g. 'E' -> 5
+    """
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index
+
+
+def is_date_format(number_format: str) -> bool:
+    number_format = STRIP_FORMAT.sub('', number_format.split(';')[0])
+    return DATE_FORMAT.search(number_format) is not None
+
+
+def from_excel(serial: Union[int, float], epoch: datetime.datetime,
+               timedelta: bool = False) -> Union[datetime.datetime, datetime.time, datetime.timedelta]:
+    """
+    converts a date serial the way openpyxl does, including excel's 1900 leap year bug
+    """
+    if timedelta:
+        delta = datetime.timedelta(days=serial)
+        if delta.microseconds:
+            delta = datetime.timedelta(seconds=delta.total_seconds() // 1,
+                                       microseconds=round(delta.microseconds, -3))
+        return delta
+    day, fraction = divmod(serial, 1)
+    diff = datetime.timedelta(milliseconds=round(fraction * SECONDS_PER_DAY * 1000))
+    if 0 <= serial < 1 and diff.days == 0:
+        return (datetime.datetime.min + diff).time()
+    if 0 < serial < 60 and epoch == WINDOWS_EPOCH:
+        day += 1
+    return epoch + datetime.timedelta(days=day) + diff
+
+
+def to_number(text: str) -> Union[int, float]:
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+
+def text_content(element) -> str:
+    """
+    :return: the text of a shared or inline string without its formatting (and without phonetic runs)
+    """
+    snippets = []
+    for child in element:
+        name = local_name(child.tag)
+        if name == 't':
+            snippets.append(child.text or '')
+        elif name == 'r':
+            snippets.extend(t.text or '' for t in child if local_name(t.tag) == 't')
+    return ''.join(snippets)
+
+
+@dataclass(frozen=True)
+class Color:
+    index: Union[str, int, bool] = '00000000'
+
+
+@dataclass(frozen=True)
+class Fill:
+    start_color: Color = Color()
+
+
+NO_FILL = Fill()
+
+
+def read_color(element) -> Color:
+    """
+    :return: the color's index the way openpyxl reports it: indexed, theme, auto or argb
+    """
+    if element is None:
+        return Color()
+    if element.get('indexed') is not None:
+        return Color(int(element.get('indexed')))
+    if element.get('theme') is not None:
+        return Color(int(element.get('theme')))
+    if element.get('auto') in ('1', 'true'):
+        return Color(True)
+    rgb = element.get('rgb', '00000000')
+    return Color('00' + rgb if len(rgb) == 6 else rgb)
+
+
+class Styles:
+    """
+    the fills and date formats of the cell styles in styles.xml
+    """
+
+    def __init__(self, fills: list[Fill], style_fills: list[int], date_styles: set[int],
+                 timedelta_styles: set[int]):
+        self.fills = fills
+        self.style_fills = style_fills
+        self.date_styles = date_styles
+        self.timedelta_styles = timedelta_styles
+
+    @classmethod
+    def read(cls, source) -> 'Styles':
+        number_formats: dict[int, str] = {}
+        fills: list[Fill] = []
+        style_fills: list[int] = []
+        date_styles: set[int] = set()
+        timedelta_styles: set[int] = set()
+        section = None
+        for event, element in iterparse(source, ('start', 'end')):
+            name = local_name(element.tag)
+            if event == 'start':
+                if name in ('fills', 'cellXfs', 'cellStyleXfs', 'numFmts'):
+                    section = name
+                continue
+            if name == 'numFmt' and section == 'numFmts':
+                number_formats[int(element.get('numFmtId'))] = element.get('formatCode', '')
+            elif name == 'fill' and section == 'fills':
+                pattern = next((child for child in element if local_name(child.tag) == 'patternFill'), None)
+                if pattern is None:  # a gradient fill has no start color
+                    fills.append(Fill(Color(None)))
+                else:
+                    fg_color = next((child for child in pattern if local_name(child.tag) == 'fgColor'), None)
+                    fills.append(Fill(read_color(fg_color)))
+            elif name == 'xf' and section == 'cellXfs':
+                style_id = len(style_fills)
+                style_fills.append(int(element.get('fillId', 0)))
+                format_id = int(element.get('numFmtId', 0))
+                number_format = number_formats.get(format_id)
+                if number_format is None:
+                    is_date = format_id in BUILTIN_DATE_FORMATS
+                    is_timedelta = format_id in BUILTIN_TIMEDELTA_FORMATS
+                else:
+                    is_date = is_date_format(number_format)
+                    is_timedelta = TIMEDELTA_FORMAT.search(number_format.split(';')[0]) is not None
+                if is_date:
+                    date_styles.add(style_id)
+                if is_timedelta:
+                    timedelta_styles.add(style_id)
+            elif name in ('fills', 'cellXfs', 'cellStyleXfs', 'numFmts'):
+                section = None
+        return cls(fills, style_fills, date_styles, timedelta_styles)
+
+    def fill(self, style_id: int) -> Fill:
+        try:
+            return self.fills[self.style_fills[style_id]]
+        except IndexError:
+            return NO_FILL
+
+
+class XlsxCell:
+    __slots__ = ('parent', 'row', 'column', 'value', 'style_id')
+
+    def __init__(self, parent: 'XlsxWorksheet', row: int, column: int, value, style_id: int):
+        self.parent = parent
+        self.row = row
+        self.column = column
+        self.value = value
+        self.style_id = style_id
+
+    @property
+    def fill(self) -> Fill:
+        return self.parent.parent.styles.fill(self.style_id)
+
+    def __repr__(self):
+        return f'<XlsxCell {self.parent.title!r}.{self.row},{self.column}>'
+
+
+class EmptyCell:
+    __slots__ = ()
+    value = None
+    fill = NO_FILL
+
+
+EMPTY_CELL = EmptyCell()
+
+
+class XlsxWorksheet:
+    def __init__(self, parent: 'XlsxWorkbook', title: str, path: str):
+        self.parent = parent
+        self.title = title
+        self.path = path
+
+    def iter_rows(self, min_row: int = 1, max_row: Optional[int] = None,
+                  max_col: Optional[int] = None) -> Iterator[tuple]:
+        """
+        streams the rows of the sheet like openpyxl's `iter_rows` with min_col=1, except that rows missing from
+        the xml are skipped instead of yielded empty
+        :param max_col: every row is padded to this many cells, by default rows end at their last cell
+        """
+        workbook = self.parent
+        styles = workbook.styles
+        row_number = 0
+        shared_formulas: dict[str, object] = {}
+        with workbook.archive.open(self.path) as source:
+            sheet_data = None
+            for event, element in iterparse(source, ('start', 'end')):
+                name = local_name(element.tag)
+                if event == 'start':
+                    if name == 'sheetData':
+                        sheet_data = element
+                    continue
+                if name != 'row':
+                    if name == 'sheetData':
+                        break
+                    continue
+
+                row_number = int(float(element.get('r'))) if element.get('r') else row_number + 1
+                if max_row is not None and row_number > max_row:
+                    break
+                if row_number >= min_row:
+                    cells = self.read_row(element, row_number, styles, shared_formulas)
+                    width = max_col or (cells[-1].column if cells else 0)
+                    row = [EMPTY_CELL] * width
+                    for cell in cells:
+                        if cell.column <= width:
+                            row[cell.column - 1] = cell
+                    yield tuple(row)
+                if sheet_data is not None:
+                    sheet_data.clear()
+
+    def read_row(self, element, row_number: int, styles: Styles, shared_formulas: dict) -> list[XlsxCell]:
+        cells = []
+        column = 0
+        for cell in element:
+            if local_name(cell.tag) != 'c':
+                continue
+            coordinate = cell.get('r')
+            if coordinate:
+                match = COORDINATE.match(coordinate)
+                column = column_index(match.group(1))
+            else:
+                column += 1
+            style_id = int(cell.get('s', 0))
+            cells.append(XlsxCell(self, row_number, column,
+                                  self.read_value(cell, coordinate, style_id, styles, shared_formulas), style_id))
+        return cells
+
+    def read_value(self, cell, coordinate: Optional[str], style_id: int, styles: Styles, shared_formulas: dict):
+        data_type = cell.get('t', 'n')
+        value = formula = inline = None
+        for child in cell:
+            name = local_name(child.tag)
+            if name == 'v':
+                value = child.text or None
+            elif name == 'f':
+                formula = child
+            elif name == 'is':
+                inline = child
+
+        if formula is not None:
+            return self.read_formula(formula, coordinate, shared_formulas)
+        if data_type == 'inlineStr':
+            return None if inline is None else text_content(inline)
+        if value is None:
+            return None
+        if data_type == 'n':
+            number = to_number(value)
+            if style_id in styles.date_styles:
+                try:
+                    return from_excel(number, self.parent.epoch, timedelta=style_id in styles.timedelta_styles)
+                except (ValueError, OverflowError):
+                    logger.warning('Cell %s is marked as a date but %s is out of range', coordinate, value)
+                    return '#VALUE!'
+            return number
+        if data_type == 's':
+            return self.parent.shared_strings[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        if data_type == 'd':
+            return datetime.datetime.fromisoformat(value.rstrip('Z'))
+        return value  # str, e (error)
+
+    @staticmethod
+    def read_formula(formula, coordinate: Optional[str], shared_formulas: dict) -> str:
+        """
+        :return: the formula, not its value, like openpyxl without `data_only`
+        """
+        value = '=' + (formula.text or '')
+        if formula.get('t') == 'shared':
+            index = formula.get('si')
+            if index in shared_formulas:
+                return shared_formulas[index].translate_formula(coordinate)
+            if value != '=':
+                # rare, so openpyxl's translator is only imported for workbooks that have shared formulas
+                from openpyxl.formula.translate import Translator
+                shared_formulas[index] = Translator(value, coordinate)
+        return value
+
+
+class XlsxWorkbook:
+    """
+    an xlsx file opened for reading, has the parts of openpyxl's read only workbook that `ExcelWorker` uses
+    """
+
+    def __init__(self, path: str):
+        self.archive = zipfile.ZipFile(path)
+        self._shared_strings: Optional[list[str]] = None
+        try:
+            workbook_path = self.relationships('_rels/.rels')['officeDocument'][0][1]
+            parts = self.relationships(posixpath.join(posixpath.dirname(workbook_path), '_rels',
+                                                      posixpath.basename(workbook_path) + '.rels'))
+            self.shared_strings_path = parts['sharedStrings'][0][1] if 'sharedStrings' in parts else None
+            if 'styles' in parts:
+                with self.archive.open(parts['styles'][0][1]) as source:
+                    self.styles = Styles.read(source)
+            else:
+                self.styles = Styles([], [], set(), set())
+            self.read_workbook(workbook_path, parts.get('worksheet', []))
+        except BaseException:
+            self.archive.close()
+            raise
+
+    def relationships(self, path: str) -> dict[str, list[tuple[str, str]]]:
+        """
+        :return: the (id, path in the zip) of every relationship in `path` by its type, e.g. 'styles'
+        """
+        # targets are relative to the directory of the part that owns the relationships
+        directory = posixpath.dirname(posixpath.dirname(path))
+        relationships: dict[str, list[tuple[str, str]]] = {}
+        with self.archive.open(path) as source:
+            for _, element in iterparse(source):
+                if local_name(element.tag) != 'Relationship':
+                    continue
+                target = element.get('Target')
+                if target.startswith('/'):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join(directory, target))
+                relationships.setdefault(element.get('Type').rpartition('/')[2], []).append(
+                    (element.get('Id'), target))
+        return relationships
+
+    def read_workbook(self, workbook_path: str, worksheets: list[tuple[str, str]]):
+        paths = dict(worksheets)
+        self.epoch = WINDOWS_EPOCH
+        self.worksheets: list[XlsxWorksheet] = []
+        self.active_index = 0
+        with self.archive.open(workbook_path) as source:
+            for _, element in iterparse(source):
+                name = local_name(element.tag)
+                if name == 'workbookPr' and element.get('date1904') in ('1', 'true'):
+                    self.epoch = MAC_EPOCH
+                elif name == 'workbookView':
+                    self.active_index = int(element.get('activeTab', 0))
+                elif name == 'sheet':
+                    path = paths.get(element.get(f'{REL_NS}id'))
+                    if path is not None:
+                        self.worksheets.append(XlsxWorksheet(self, element.get('name'), path))
+
+    @property
+    def shared_strings(self) -> list[str]:
+        if self._shared_strings is None:
+            strings = []
+            if self.shared_strings_path is not None:
+                with self.archive.open(self.shared_strings_path) as source:
+                    for _, element in iterparse(source):
+                        if local_name(element.tag) == 'si':
+                            strings.append(text_content(element).replace('x005F_', ''))
+                            element.clear()
+            self._shared_strings = strings
+        return self._shared_strings
+
+    @property
+    def sheetnames(self) -> list[str]:
+        return [worksheet.title for worksheet in self.worksheets]
+
+    @property
+    def active(self) -> Optional[XlsxWorksheet]:
+        try:
+            return self.worksheets[self.active_index]
+        except IndexError:
+            return None
+
+    def __getitem__(self, name: str) -> XlsxWorksheet:
+        for worksheet in self.worksheets:
+            if worksheet.title == name:
+                return worksheet
+        raise KeyError(f'Worksheet {name} does not exist.')
+
+    def close(self):
+        self.archive.close()
@@ -0,0 +1,33 @@
+from functools import partial
+from http.server import ThreadingHTTPServer
+import importlib.util
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+# the modules of the bot import each other as top level modules, as when it runs from `src`
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from helpers import RecordingHandler  # noqa: E402, needs the path above
+
+# `bot` imports the deployment's secrets, which a checkout doesn't have. the tests never reach telegram or the
+# workbook's url, so placeholders do
+if importlib.util.find_spec('creds') is None:
+    sys.modules['creds'] = types.ModuleType('creds')
+    sys.modules['creds'].__dict__.update(BOT_TOKEN='', DEV_TOKEN='', DOWNLOAD_URL='', EXCEL_URL='')
+
+
+@pytest.fixture
+def server(tmp_path):
+    directory = tmp_path / 'served'
+    directory.mkdir()
+    RecordingHandler.statuses = []
+    RecordingHandler.delay = 0.0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(RecordingHandler, directory=str(directory)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, directory
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,49 @@
+"""
+stand-ins shared by the tests: a local http server for the workbook's download url, and workbooks to serve
+"""
+from http.server import SimpleHTTPRequestHandler
+import datetime
+import os
+import time
+
+from openpyxl import Workbook
+
+from excel_handler import ExcelWorker
+
+
+class RecordingHandler(SimpleHTTPRequestHandler):
+    """
+    serves a directory (answering If-Modified-Since with a 304) and records the status of every response
+    """
+    statuses: list[int] = []
+    delay = 0.0  # seconds, a slow server
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        super().do_GET()
+
+    def log_request(self, code='-', size='-'):
+        self.statuses.append(int(code))
+
+
+def write_workbook(path, event: str, modified: float):
+    """
+    writes a workbook in the default layout with a single grade 9 exam on this week's sunday
+    """
+    workbook = Workbook()
+    worksheet = workbook.active
+    for column, name in enumerate(('ט1', 'י1', 'יא1', 'יב1'), start=6):
+        worksheet.cell(row=2, column=column, value=name)
+    sunday = ExcelWorker.get_this_week_sunday()
+    for day in range(14):
+        worksheet.cell(row=3 + day, column=5,
+                       value=datetime.datetime.combine(sunday + datetime.timedelta(days=day), datetime.time()))
+    worksheet.cell(row=3, column=6, value=event)
+    workbook.save(path)
+    os.utime(path, (modified, modified))  # the server's Last-Modified has a one second resolution
+
+
+def write_broken(path, modified: float):
+    with open(path, 'wb') as f:
+        f.write(b'not a workbook')
+    os.utime(path, (modified, modified))
@@ -0,0 +1,40 @@
+import pytest
+
+from admin import parse_record, validate
+
+
+def test_csv_values_are_converted():
+    chat_id, info = validate({'chat_id': '-100', 'grade': '11', 'days': '14', 'wantsUpdate': 'yes',
+                              'digestDay': '6', 'digestTime': '7:05', 'reminders': '0'})
+    assert chat_id == '-100'
+    assert info == {'grade': 11, 'days': 14, 'wantsUpdate': True, 'digestDay': 6, 'digestTime': '07:05',
+                    'reminders': False}
+
+
+def test_empty_values_are_left_out():
+    assert validate({'chat_id': 5, 'grade': 9, 'days': '', 'digestTime': None}) == ('5', {'grade': 9})
+
+
+@pytest.mark.parametrize('record, error', [
+    (['1', 9], 'expected an object'),
+    ({'chat_id': '1', None: ['extra']}, 'more values than columns'),
+    ({'chat_id': '1', 'name': 'x'}, 'unknown fields: name'),
+    ({'grade': 9}, 'missing chat_id'),
+    ({'chat_id': 'abc'}, 'chat_id should be a number'),
+    ({'chat_id': '1', 'grade': 8}, 'grade should be one of'),
+    ({'chat_id': '1', 'grade': True}, 'grade should be a number'),
+    ({'chat_id': '1', 'days': 10}, 'days should be a multiple of 7'),
+    ({'chat_id': '1', 'days': 35}, 'days should be a multiple of 7'),
+    ({'chat_id': '1', 'digestDay': 7}, 'digestDay should be between'),
+    ({'chat_id': '1', 'digestTime': '25:00'}, 'does not match format'),
+    ({'chat_id': '1', 'wantsUpdate': 'maybe'}, 'expected a boolean'),
+])
+def test_invalid_records(record, error):
+    with pytest.raises(ValueError, match=error):
+        validate(record)
+
+
+def test_jsonl_lines_are_parsed():
+    assert parse_record('{"chat_id": 3, "days": 21}') == ('3', {'days': 21})
+    with pytest.raises(ValueError, match='invalid json'):
+        parse_record('{"chat_id": 3,')
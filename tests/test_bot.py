@@ -0,0 +1,54 @@
+import shutil
+
+import pytest
+
+from bot import Bot
+from delivery_scheduler import DIGEST, Delivery
+from excel_handler import ExcelWorker
+from fake_bot import FakeBot
+from helpers import write_workbook
+
+
+class RecordingBot(FakeBot):
+    def __init__(self):
+        super().__init__()
+        self.texts: dict[str, str] = {}
+
+    def send_message(self, chat_id, **kwargs):
+        super().send_message(chat_id, **kwargs)
+        self.texts[chat_id] = kwargs['text']
+
+
+@pytest.fixture
+def bot(server, tmp_path):
+    http_server, directory = server
+    write_workbook(directory / 'schedule.xlsx', 'מתמטיקה', modified=1_000_000)
+    shutil.copy(directory / 'schedule.xlsx', tmp_path / 'schedule.xlsx')
+    url = f'http://127.0.0.1:{http_server.server_port}/schedule.xlsx'
+    # with broadcast workers, to check the digests still don't go through the worker processes
+    bot = Bot('123456:test', str(tmp_path / 'userdata.json'), str(tmp_path / 'schedule.xlsx'), True,
+              download_url=url, broadcast_workers=2)
+    bot.bot = RecordingBot()
+    yield bot
+    bot.close()
+
+
+def test_digest_late_in_the_week_starts_at_next_week(bot):
+    bot.users['1'] = {'grade': 9, 'days': 7, 'wantsUpdate': True, 'digestDay': 6}  # sunday
+    bot.users['2'] = {'grade': 9, 'days': 7, 'wantsUpdate': True, 'digestDay': 5}  # saturday
+    occurrence = ExcelWorker.get_this_week_sunday().isoformat()
+
+    bot.deliver(DIGEST, occurrence, [Delivery(DIGEST, '1', occurrence), Delivery(DIGEST, '2', occurrence)])
+    texts = bot.bot.texts
+    assert Bot.WEEKS_FORMAT[0] in texts['1'] and 'מתמטיקה' in texts['1']
+    assert Bot.WEEKS_FORMAT[0] not in texts['2'] and 'מתמטיקה' not in texts['2']
+    assert Bot.WEEKS_FORMAT[1] in texts['2']
+
+
+def test_digest_reaches_the_whole_horizon_from_next_week(bot):
+    bot.users['1'] = {'grade': 9, 'days': 7 * Bot.MAX_WEEK, 'wantsUpdate': True, 'digestDay': 4}  # friday
+    occurrence = ExcelWorker.get_this_week_sunday().isoformat()
+
+    bot.deliver(DIGEST, occurrence, [Delivery(DIGEST, '1', occurrence)])
+    text = bot.bot.texts['1']
+    assert [week for week, name in Bot.WEEKS_FORMAT.items() if name in text] == list(range(1, Bot.MAX_WEEK + 1))
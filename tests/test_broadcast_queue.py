@@ -0,0 +1,65 @@
+import pytest
+
+from broadcast_queue import PENDING, SENDING, SENT, UNKNOWN, BroadcastQueue, run_broadcast, work
+from fake_bot import FakeBot
+from metrics import BROADCAST_MESSAGES, QUEUE_DEPTH
+
+MESSAGE = {'text': 'exams'}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'broadcasts.db')
+
+
+@pytest.fixture
+def queue(path):
+    queue = BroadcastQueue(path)
+    yield queue
+    queue.close()
+
+
+def chats(first: int, last: int) -> list[str]:
+    return [str(chat_id) for chat_id in range(first, last)]
+
+
+def test_enqueuing_a_run_again_adds_only_new_chats(queue):
+    assert queue.enqueue('run', 'digest', {'9/14': (MESSAGE, chats(0, 10))}) == 10
+    assert queue.enqueue('run', 'digest', {'9/14': (MESSAGE, chats(5, 15))}) == 5
+    assert queue.stats('run') == {PENDING: 15}
+    assert sorted(chat_id for chat_id, _ in queue.messages('run')) == sorted(chats(0, 15))
+
+
+def test_a_job_interrupted_while_sending_is_not_sent_again(path, queue):
+    queue.enqueue('run', 'digest', {'9/14': (MESSAGE, chats(0, 3))})
+    chat_id, kwargs = queue.claim('run', 'crashed')
+    assert kwargs == MESSAGE
+    assert queue.stats('run') == {PENDING: 2, SENDING: 1}
+
+    restarted = BroadcastQueue(path)
+    assert restarted.recover('run') == 1
+    claimed = {restarted.claim('run', 'restarted')[0], restarted.claim('run', 'restarted')[0]}
+    assert restarted.claim('run', 'restarted') is None
+    assert chat_id not in claimed
+    assert restarted.stats('run') == {SENDING: 2, UNKNOWN: 1}
+    restarted.close()
+
+
+def test_work_sends_every_job_once(path, queue):
+    queue.enqueue('run', 'digest', {'9/14': (MESSAGE, chats(0, 20)), '10/7': ({'text': 'other'}, chats(20, 30))})
+    bot = FakeBot()
+    work(path, '', 'run', 'worker', rate=1000, bot=bot)
+    assert sorted(chat_id for chat_id, _ in bot.sent) == sorted(chats(0, 30))
+    assert queue.stats('run') == {SENT: 30}
+
+
+def test_run_broadcast_exports_the_queue_to_the_metrics(path, queue):
+    queue.enqueue('run', 'digest', {'9/14': (MESSAGE, chats(0, 4))})
+    queue.claim('run', 'crashed')
+    unknown = BROADCAST_MESSAGES.get(result=UNKNOWN)
+
+    # no worker processes: only what run_broadcast itself does, recovering the crashed job
+    assert run_broadcast(path, '', 'run', processes=0) == {PENDING: 3, UNKNOWN: 1}
+    assert BROADCAST_MESSAGES.get(result=UNKNOWN) == unknown + 1
+    assert QUEUE_DEPTH.get() == 3
+    assert dict(queue.unfinished_runs()) == {'run': 'digest'}
@@ -0,0 +1,116 @@
+import datetime
+import os
+import shutil
+import time
+
+import pytest
+
+from excel_handler import ExcelWorker, WorkbookSource
+from helpers import RecordingHandler, write_broken, write_workbook
+
+INTERVALS = [0, 7]
+
+
+@pytest.fixture(params=['openpyxl', 'xlsx'])
+def worker(request, server, tmp_path):
+    http_server, directory = server
+    served = directory / 'schedule.xlsx'
+    write_workbook(served, 'מתמטיקה', modified=1_000_000)
+    local = tmp_path / 'schedule.xlsx'
+    shutil.copy(served, local)
+    url = f'http://127.0.0.1:{http_server.server_port}/schedule.xlsx'
+    return ExcelWorker(WorkbookSource('test', url, str(local), reader=request.param), INTERVALS)
+
+
+def exams(worker: ExcelWorker) -> list[str]:
+    return [event.name for event in worker.schedule[9][0]]
+
+
+def test_unchanged_workbook_is_not_downloaded_again(worker):
+    assert exams(worker) == ['מתמטיקה']
+    assert worker.last_modified is not None
+    RecordingHandler.statuses.clear()
+
+    assert not worker.refresh_workbook()
+    assert RecordingHandler.statuses == [304]
+
+
+def test_changed_workbook_is_reparsed(worker, server):
+    _, directory = server
+    write_workbook(directory / 'schedule.xlsx', 'אנגלית', modified=2_000_000)
+
+    version = worker.version
+    worker.update_schedule(INTERVALS)
+    assert exams(worker) == ['אנגלית']
+    assert worker.version > version
+
+
+def validators(worker: ExcelWorker) -> tuple:
+    return worker.etag, worker.last_modified, worker.content_hash
+
+
+def test_workbook_that_failed_to_parse_is_parsed_again(worker, server):
+    _, directory = server
+    before = validators(worker)
+    write_broken(directory / 'schedule.xlsx', modified=2_000_000)
+
+    with pytest.raises(Exception):
+        worker.refresh_workbook()
+    assert validators(worker) == before
+    assert exams(worker) == ['מתמטיקה']
+
+    # the same broken workbook is downloaded and fails again, rather than getting a 304
+    RecordingHandler.statuses.clear()
+    with pytest.raises(Exception):
+        worker.refresh_workbook()
+    assert RecordingHandler.statuses == [200]
+
+    # and once it is fixed (with the same modification time) it is picked up
+    write_workbook(directory / 'schedule.xlsx', 'אנגלית', modified=2_000_000)
+    worker.update_schedule(INTERVALS)
+    assert exams(worker) == ['אנגלית']
+
+
+def test_workbook_that_failed_to_parse_does_not_replace_the_local_one(worker, server):
+    _, directory = server
+    local_hash = ExcelWorker.file_hash(worker.workbook_path)
+    write_broken(directory / 'schedule.xlsx', modified=2_000_000)
+
+    with pytest.raises(Exception):
+        worker.refresh_workbook()
+    assert ExcelWorker.file_hash(worker.workbook_path) == local_hash
+    assert [name for name in os.listdir(os.path.dirname(worker.workbook_path)) if '.tmp' in name] == []
+
+    # a restart still starts from the good workbook
+    os.remove(f'{worker.workbook_path}.cache')
+    restarted = ExcelWorker(worker.source, INTERVALS)
+    assert exams(restarted) == ['מתמטיקה']
+
+
+def test_failed_refresh_keeps_the_schedule_and_backs_off(worker, server):
+    _, directory = server
+    write_broken(directory / 'schedule.xlsx', modified=2_000_000)
+    version = worker.version
+    worker.expires_at = datetime.datetime.now()
+
+    worker.update_schedule(INTERVALS)
+    assert worker.version == version
+    assert exams(worker) == ['מתמטיקה']
+    assert worker.expires_at > datetime.datetime.now() + worker.RETRY_AFTER_FAILURE / 2
+
+    # until then lookups are served without downloading again
+    RecordingHandler.statuses.clear()
+    assert worker.get_schedule(INTERVALS) is worker.schedule
+    assert RecordingHandler.statuses == []
+
+
+def test_start_from_cache_does_not_wait_for_the_download(worker):
+    RecordingHandler.delay = 2.0
+    start = time.monotonic()
+    cached = ExcelWorker(worker.source, INTERVALS)
+    assert time.monotonic() - start < 1
+    assert exams(cached) == ['מתמטיקה']
+
+    with cached._refresh_lock:  # the first refresh ran in the background
+        assert RecordingHandler.statuses
+    assert exams(cached) == ['מתמטיקה']
@@ -0,0 +1,49 @@
+import shutil
+import threading
+
+import pytest
+
+from excel_handler import WorkbookSource
+from helpers import RecordingHandler, write_workbook
+from sources import SourceRegistry
+
+INTERVALS = [0, 7]
+
+
+@pytest.fixture
+def source(server, tmp_path):
+    http_server, directory = server
+    write_workbook(directory / 'schedule.xlsx', 'מתמטיקה', modified=1_000_000)
+    shutil.copy(directory / 'schedule.xlsx', tmp_path / 'schedule.xlsx')
+    return WorkbookSource('test', f'http://127.0.0.1:{http_server.server_port}/schedule.xlsx',
+                          str(tmp_path / 'schedule.xlsx'))
+
+
+def test_concurrent_adds_of_a_source_create_one_worker(source):
+    RecordingHandler.delay = 0.5  # both adds are loading at the same time
+    registry = SourceRegistry(INTERVALS)
+    workers, errors = [], []
+
+    def add():
+        try:
+            workers.append(registry.add(source))
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(workers) == 1 and len(errors) == 1
+    assert registry['test'] is workers[0]
+    assert len(RecordingHandler.statuses) == 1  # the second add didn't download the workbook
+
+
+def test_a_source_that_failed_to_load_can_be_added_again(source, tmp_path):
+    registry = SourceRegistry(INTERVALS)
+    missing = WorkbookSource(source.name, source.download_url, str(tmp_path / 'missing.xlsx'))
+    with pytest.raises(OSError):
+        registry.add(missing)
+    assert registry.add(source) is registry['test']
@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+from user_store import SqliteUserStore, open_user_store, write_users
+
+USERS = {'1': {'grade': 9, 'days': 14, 'wantsUpdate': True},
+         '2': {'grade': 10, 'days': 7, 'wantsUpdate': False},
+         '3': {'grade': 12, 'days': 28, 'wantsUpdate': True, 'digestDay': 1, 'digestTime': '18:30',
+               'reminders': True}}
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    path = tmp_path / 'userdata.json'
+    path.write_text(json.dumps(USERS))
+    return str(path)
+
+
+def users(store) -> dict:
+    return dict(store.items())
+
+
+def test_json_is_migrated_once(legacy):
+    store = open_user_store(legacy)
+    assert users(store) == USERS
+    store.update('1', days=28)
+    store.close()
+
+    store = open_user_store(legacy)
+    assert store['1']['days'] == 28  # not migrated again over the newer value
+    store.close()
+
+
+def test_interrupted_migration_is_done_again(legacy, monkeypatch):
+    write = SqliteUserStore.write
+    written = []
+
+    def interrupted(self, chat_id, info):
+        if written:
+            raise KeyboardInterrupt
+        written.append(chat_id)
+        write(self, chat_id, info)
+
+    monkeypatch.setattr(SqliteUserStore, 'write', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        open_user_store(legacy)
+    monkeypatch.setattr(SqliteUserStore, 'write', write)
+
+    assert os.path.exists(legacy.replace('.json', '.db'))
+    store = open_user_store(legacy)
+    assert users(store) == USERS
+    store.close()
+
+
+def test_migration_keeps_users_imported_before_the_first_run(legacy):
+    write_users(legacy.replace('.json', '.db'), [('1', {'grade': 11, 'days': 7, 'wantsUpdate': True})])
+
+    store = open_user_store(legacy)
+    assert store['1'] == {'grade': 11, 'days': 7, 'wantsUpdate': True}
+    assert store['2'] == USERS['2']
+    assert len(store) == len(USERS)
+    store.close()
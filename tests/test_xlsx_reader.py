@@ -0,0 +1,36 @@
+import shutil
+
+from openpyxl import load_workbook
+
+from benchmark import INTERVALS, generate_workbook
+from event import EventType
+from excel_handler import ExcelWorker, WorkbookSource, parse_workbook
+
+ROWS = 120
+
+
+def test_readers_parse_the_same_events(server, tmp_path):
+    http_server, directory = server
+    path = directory / 'schedule.xlsx'
+    generate_workbook(str(path), ROWS, columns_per_grade=3, density=0.3, merge_ratio=0.2)
+    local = tmp_path / 'schedule.xlsx'
+    shutil.copy(path, local)
+    url = f'http://127.0.0.1:{http_server.server_port}/schedule.xlsx'
+    grades = ExcelWorker(WorkbookSource('test', url, str(local)), INTERVALS).GRADES
+
+    parsed = {reader: parse_workbook(str(path), grades, WorkbookSource('test', '', str(path), reader=reader))
+              for reader in ('openpyxl', 'xlsx')}
+    assert parsed['xlsx'] == parsed['openpyxl']
+
+    events, row_dates = parsed['xlsx']
+    assert len(row_dates) == ROWS
+    assert len(set(row_dates.values())) == ROWS
+    assert any(event.type_ == EventType.MOCK_BAGROT and not event.name.startswith('מתכ')
+               for rows in events.values() for day in rows.values() for event in day)
+
+    # a range merged across a grade's classes is one event, on that grade's row only
+    merged = load_workbook(str(path)).active.merged_cells.ranges
+    assert merged
+    for cells in merged:
+        grade = next(grade for grade, (first, last) in grades.items() if first == cells.min_col)
+        assert len(events[grade][cells.min_row]) == 1